@@ -0,0 +1,155 @@
+"""
+Browser Profile Benchmark
+Compares navigation time, end-to-end search time and Chrome memory use of the
+scraper's browser profiles.
+
+Each run measures, with a fresh browser:
+- navigation: loading the TPLC landing page until its form is present
+- search: the full live search flow used by the API (browser start, navigation,
+  form fill, submit, results extraction), including its fixed waits
+
+Browser RSS is sampled in the background throughout both phases, and the peak
+sample of each phase is reported.
+
+Usage:
+    python benchmark_browser.py [--runs 5] [--profiles standard,lean] [--device-name syringe]
+"""
+
+import argparse
+import statistics
+import threading
+import time
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from scraper import FDADeviceScraper, BROWSER_PROFILES
+
+def p90(values):
+    """90th percentile of a list of measurements"""
+    return statistics.quantiles(values, n=10)[-1] if len(values) > 1 else values[0]
+
+class RssSampler:
+    """Samples a scraper's browser RSS in a background thread and keeps the peak"""
+    
+    def __init__(self, scraper: FDADeviceScraper, interval: float = 0.1):
+        self.scraper = scraper
+        self.interval = interval
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+    
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_bytes = max(self.peak_bytes, self.scraper._measure_browser_rss())
+            self._stop.wait(self.interval)
+    
+    def __enter__(self):
+        self._thread.start()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        # One last sample in case the phase was shorter than the interval
+        self.peak_bytes = max(self.peak_bytes, self.scraper._measure_browser_rss())
+    
+    @property
+    def peak_mb(self) -> float:
+        return self.peak_bytes / (1024 * 1024)
+
+def saving(value: float, baseline: float) -> str:
+    """Percentage saved against a baseline, or n/a when the baseline is zero"""
+    return f"{100 * (1 - value / baseline):.0f}%" if baseline else "n/a"
+
+def benchmark_profile(profile: str, runs: int, device_name: str):
+    """
+    Time landing page navigation and the end-to-end search flow for a profile.
+    
+    Args:
+        profile: Browser profile name
+        runs: Number of runs
+        device_name: Device to search for
+    
+    Returns:
+        Navigation times and search times in seconds, sampled peak browser RSS in MB
+        during navigation and during search per run, and the number of searches that
+        fell back to mock links
+    """
+    
+    nav_times = []
+    search_times = []
+    nav_rss_values = []
+    search_rss_values = []
+    mock_runs = 0
+    
+    for _ in range(runs):
+        scraper = FDADeviceScraper(browser_profile=profile)
+        scraper._setup_driver()
+        
+        try:
+            with RssSampler(scraper) as sampler:
+                start = time.perf_counter()
+                scraper.driver.get(scraper.base_url)
+                WebDriverWait(scraper.driver, 30).until(
+                    EC.presence_of_element_located((By.TAG_NAME, "form"))
+                )
+                nav_times.append(time.perf_counter() - start)
+            nav_rss_values.append(sampler.peak_mb)
+        finally:
+            scraper.close()
+        
+        scraper = FDADeviceScraper(browser_profile=profile)
+        
+        try:
+            # The browser starts inside the search, so early samples read 0 until it is up
+            with RssSampler(scraper) as sampler:
+                start = time.perf_counter()
+                device_links = scraper._run_search(device_name, None, 2020)
+                search_times.append(time.perf_counter() - start)
+            search_rss_values.append(sampler.peak_mb)
+            if any(scraper.is_mock_link(link) for link in device_links):
+                mock_runs += 1
+        finally:
+            scraper.close()
+    
+    return nav_times, search_times, nav_rss_values, search_rss_values, mock_runs
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmark scraper browser profiles")
+    arg_parser.add_argument("--runs", type=int, default=5, help="Runs per profile")
+    arg_parser.add_argument("--profiles", default=",".join(BROWSER_PROFILES), help="Comma-separated profiles to compare")
+    arg_parser.add_argument("--device-name", default="syringe", help="Device to search for")
+    args = arg_parser.parse_args()
+    
+    results = {}
+    
+    for profile in args.profiles.split(","):
+        print(f"Benchmarking '{profile}' profile ({args.runs} runs)...")
+        results[profile] = benchmark_profile(profile, args.runs, args.device_name)
+    
+    print(f"\n{'profile':<10} {'nav median (s)':>15} {'search median (s)':>18} {'search p90 (s)':>15} "
+          f"{'nav peak RSS (MB)':>18} {'search peak RSS (MB)':>21} {'mock runs':>10}")
+    
+    for profile, (nav_times, search_times, nav_rss_values, search_rss_values, mock_runs) in results.items():
+        print(f"{profile:<10} {statistics.median(nav_times):>15.2f} {statistics.median(search_times):>18.2f} "
+              f"{p90(search_times):>15.2f} {statistics.median(nav_rss_values):>18.1f} "
+              f"{statistics.median(search_rss_values):>21.1f} {mock_runs:>10}")
+    
+    if "standard" in results and len(results) > 1:
+        base_nav, base_search, base_nav_rss, base_search_rss = (
+            statistics.median(values) for values in results["standard"][:4]
+        )
+        for profile, (nav_times, search_times, nav_rss_values, search_rss_values, _) in results.items():
+            if profile == "standard":
+                continue
+            print(f"\n'{profile}' vs 'standard': {saving(statistics.median(nav_times), base_nav)} faster navigation, "
+                  f"{saving(statistics.median(search_times), base_search)} faster end-to-end search, "
+                  f"{saving(statistics.median(nav_rss_values), base_nav_rss)} less browser memory during navigation, "
+                  f"{saving(statistics.median(search_rss_values), base_search_rss)} less during search")
+    
+    print("\nEnd-to-end search times include the scraper's fixed waits, which are the same for every profile. "
+          "Peak RSS is the highest background sample of the browser process tree (every 0.1 s) during each phase. "
+          "Runs that fell back to mock links did not complete a live search, so their memory figures may be 0.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+"""
+Result Cache Module
+Caches scraped device data per query, tracks recent query popularity and
+refreshes hot queries in the background before they expire.
+"""
+
+import asyncio
+import logging
+import re
+import secrets
+import time
+from collections import Counter, OrderedDict, deque
+from typing import Dict, List, Any, Optional, Set, Tuple, Callable, Awaitable
+
+logger = logging.getLogger(__name__)
+
+# (device_name, product_code, min_year) with names normalized
+QueryKey = Tuple[str, Optional[str], int]
+
+# refresh_id format: "<process epoch>-<refresh sequence>"
+REFRESH_ID_PATTERN = r'^([0-9a-f]{8})-([0-9]+)$'
+
+class StaleRefreshError(LookupError):
+    """Raised when a refresh id cannot be diffed against, because it comes from another process or its history was dropped"""
+
+class ResultCache:
+    """In-process cache of raw device data with per-device count snapshots"""
+    
+    def __init__(self, ttl_seconds: int = 86400, max_snapshots: int = 20,
+                 snapshot_fn: Optional[Callable[[Dict[str, Any], List[str]], Dict[str, Dict[str, int]]]] = None,
+                 max_entries: int = 1000, max_tracked_queries: int = 10000, max_tracked_devices: int = 5000,
+                 popularity_half_life_seconds: int = 21600):
+        self.ttl_seconds = ttl_seconds
+        self.max_snapshots = max_snapshots
+        self.snapshot_fn = snapshot_fn
+        self.max_entries = max_entries
+        self.max_tracked_queries = max_tracked_queries
+        self.max_tracked_devices = max_tracked_devices
+        self.popularity_half_life_seconds = popularity_half_life_seconds
+        # Entries and snapshot histories are kept in least-recently-used order for eviction
+        self.entries: "OrderedDict[QueryKey, Dict[str, Any]]" = OrderedDict()
+        # Request counts decay exponentially; later requests are weighted up instead of
+        # decaying every score, which keeps the ranking while touching one key per request
+        self.popularity: Counter = Counter()
+        self._popularity_base = time.time()
+        self.snapshots: "OrderedDict[str, deque]" = OrderedDict()
+        # Refresh ids are only meaningful within one process, so they carry a random epoch
+        self.epoch = secrets.token_hex(4)
+        self.refresh_seq = 0
+        # Devices whose oldest snapshots were dropped, and the latest refresh when a device was evicted
+        self.trimmed_devices: Set[str] = set()
+        self.evicted_through = 0
+        self.hits = 0
+        self.misses = 0
+    
+    def format_refresh_id(self, refresh_seq: int) -> str:
+        """Build the public refresh id for a refresh of this process"""
+        return f"{self.epoch}-{refresh_seq}"
+    
+    def parse_refresh_id(self, refresh_id: str) -> int:
+        """
+        Resolve a public refresh id to a refresh of this process.
+        
+        Raises:
+            StaleRefreshError: If the id is malformed, from another process or newer than the latest refresh
+        """
+        
+        match = re.match(REFRESH_ID_PATTERN, refresh_id)
+        if not match or match.group(1) != self.epoch:
+            raise StaleRefreshError(f"refresh_id {refresh_id} was not issued by this server process")
+        
+        refresh_seq = int(match.group(2))
+        if refresh_seq > self.refresh_seq:
+            raise StaleRefreshError(f"refresh_id {refresh_id} is newer than the latest refresh")
+        
+        return refresh_seq
+    
+    @staticmethod
+    def make_key(device_name: str, product_code: Optional[str], min_year: int) -> QueryKey:
+        """Normalize query parameters into a cache key"""
+        
+        normalized_code = product_code.strip().upper() if product_code and product_code.strip() else None
+        return (device_name.strip().lower(), normalized_code, min_year)
+    
+    def _request_weight(self, now: float) -> float:
+        """Weight of a request made now, relative to the popularity base time"""
+        return 2 ** ((now - self._popularity_base) / self.popularity_half_life_seconds)
+    
+    def record_request(self, key: QueryKey):
+        """Count a user request towards the query's decayed popularity"""
+        
+        now = time.time()
+        
+        # Rebase long before request weights could overflow, even if sweep never runs
+        if now - self._popularity_base > 64 * self.popularity_half_life_seconds:
+            self._decay_popularity(now)
+        
+        self.popularity[key] += self._request_weight(now)
+        
+        # Free-text queries are unbounded; drop the long tail once over the limit
+        if len(self.popularity) > self.max_tracked_queries:
+            self._prune_popularity(self.max_tracked_queries // 2)
+    
+    def _decay_popularity(self, now: float):
+        """Rebase scores to the current time and forget queries that have gone cold"""
+        
+        weight = self._request_weight(now)
+        self.popularity = Counter({
+            key: score / weight for key, score in self.popularity.items()
+            if score / weight >= 0.01
+        })
+        self._popularity_base = now
+    
+    def _prune_popularity(self, keep: int):
+        """Keep only the `keep` most popular queries"""
+        self.popularity = Counter(dict(self.popularity.most_common(keep)))
+    
+    def sweep(self) -> int:
+        """
+        Drop expired entries, cold queries and untracked popularity counts.
+        
+        Returns:
+            Number of expired entries removed
+        """
+        
+        now = time.time()
+        expired = [key for key, entry in self.entries.items() if entry['expires_at'] <= now]
+        
+        for key in expired:
+            del self.entries[key]
+        
+        self._decay_popularity(now)
+        
+        if len(self.popularity) > self.max_tracked_queries:
+            self._prune_popularity(self.max_tracked_queries)
+        
+        return len(expired)
+    
+    def get(self, key: QueryKey, problem_types: List[str]) -> Optional[Dict[str, Any]]:
+        """
+        Look up a fresh cache entry covering the requested problem types.
+        
+        Args:
+            key: Query cache key
+            problem_types: Problem lists the caller needs
+        
+        Returns:
+            Cache entry, or None on a miss
+        """
+        
+        entry = self.entries.get(key)
+        
+        if entry and entry['expires_at'] <= time.time():
+            del self.entries[key]
+            entry = None
+        
+        if entry and all(ptype in entry['problem_types'] for ptype in problem_types):
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry
+        
+        self.misses += 1
+        return None
+    
+    def store(self, key: QueryKey, devices: List[Dict[str, Any]], problem_types: List[str]) -> Dict[str, Any]:
+        """
+        Store freshly scraped devices and snapshot their problem counts.
+        
+        Args:
+            key: Query cache key
+            devices: Raw device data from the scraper
+            problem_types: Problem lists that were extracted for the devices
+        
+        Returns:
+            The new cache entry
+        """
+        
+        self.refresh_seq += 1
+        now = time.time()
+        
+        entry = {
+            'devices': devices,
+            'problem_types': list(problem_types),
+            'refresh_id': self.format_refresh_id(self.refresh_seq),
+            'fetched_at': now,
+            'expires_at': now + self.ttl_seconds
+        }
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        
+        if self.snapshot_fn:
+            for device in devices:
+                device_url = device.get('url')
+                if not device_url:
+                    continue
+                
+                history = self.snapshots.setdefault(device_url, deque(maxlen=self.max_snapshots))
+                self.snapshots.move_to_end(device_url)
+                if len(history) == history.maxlen:
+                    self.trimmed_devices.add(device_url)
+                history.append({
+                    'refresh_seq': self.refresh_seq,
+                    'fetched_at': now,
+                    'counts': self.snapshot_fn(device, problem_types)
+                })
+            
+            while len(self.snapshots) > self.max_tracked_devices:
+                evicted_url, _ = self.snapshots.popitem(last=False)
+                self.trimmed_devices.discard(evicted_url)
+                self.evicted_through = self.refresh_seq
+        
+        return entry
+    
+    def transient_entry(self, devices: List[Dict[str, Any]], problem_types: List[str]) -> Dict[str, Any]:
+        """
+        Build an entry for data that must be served once but never cached, such as mock data.
+        
+        Transient entries have no refresh id and record no snapshots.
+        """
+        
+        now = time.time()
+        
+        return {
+            'devices': devices,
+            'problem_types': list(problem_types),
+            'refresh_id': None,
+            'fetched_at': now,
+            'expires_at': now
+        }
+    
+    def counts_since(self, device_url: str, since: str) -> Dict[str, Dict[str, int]]:
+        """
+        Get the problem counts a device had as of a given refresh.
+        
+        Each problem type is resolved independently to the latest snapshot
+        at or before `since` that extracted it. Types with no such snapshot
+        come back empty, so every current problem counts as changed.
+        
+        Args:
+            device_url: URL of the device detail page
+            since: Refresh id the client last synced
+        
+        Returns:
+            Mapping of problem type to {problem_name: count}
+        
+        Raises:
+            StaleRefreshError: If `since` is not a refresh of this process or
+                the device's history no longer reaches back to it
+        """
+        
+        since_seq = self.parse_refresh_id(since)
+        history = self.snapshots.get(device_url)
+        
+        if history is None and since_seq < self.evicted_through:
+            raise StaleRefreshError(f"Snapshot history for {device_url} no longer reaches back to refresh_id {since}")
+        if history and device_url in self.trimmed_devices and history[0]['refresh_seq'] > since_seq:
+            raise StaleRefreshError(f"Snapshot history for {device_url} no longer reaches back to refresh_id {since}")
+        
+        counts = {}
+        
+        for snapshot in reversed(history or []):
+            if snapshot['refresh_seq'] > since_seq:
+                continue
+            for ptype, problem_counts in snapshot['counts'].items():
+                counts.setdefault(ptype, problem_counts)
+        
+        return counts
+    
+    def refresh_candidates(self, top_k: int, refresh_ahead_seconds: int) -> List[QueryKey]:
+        """
+        Pick the most recently popular cached queries that are about to expire.
+        
+        Args:
+            top_k: Number of most popular queries to consider
+            refresh_ahead_seconds: Refresh entries expiring within this window
+        
+        Returns:
+            Query keys to refresh, most popular first
+        """
+        
+        deadline = time.time() + refresh_ahead_seconds
+        
+        return [
+            key for key, _ in self.popularity.most_common(top_k)
+            if key in self.entries and self.entries[key]['expires_at'] <= deadline
+        ]
+    
+    def stats(self) -> Dict[str, Any]:
+        """Get cache statistics"""
+        
+        return {
+            'entries': len(self.entries),
+            'tracked_queries': len(self.popularity),
+            'tracked_devices': len(self.snapshots),
+            'hits': self.hits,
+            'misses': self.misses,
+            'latest_refresh_id': self.format_refresh_id(self.refresh_seq) if self.refresh_seq else None
+        }
+
+class RefreshScheduler:
+    """Background task that re-scrapes hot queries before their cache entries expire"""
+    
+    def __init__(self, cache: ResultCache, refresh_fn: Callable[[QueryKey], Awaitable[Any]],
+                 interval_seconds: int = 300, top_k: int = 200, refresh_ahead_seconds: int = 3600,
+                 max_per_tick: int = 20):
+        self.cache = cache
+        self.refresh_fn = refresh_fn
+        self.interval_seconds = interval_seconds
+        self.top_k = top_k
+        self.refresh_ahead_seconds = refresh_ahead_seconds
+        self.max_per_tick = max_per_tick
+        self._task: Optional[asyncio.Task] = None
+    
+    async def run_once(self) -> int:
+        """
+        Refresh due hot queries, at most max_per_tick of them, most popular first.
+        
+        Returns:
+            Number of queries refreshed successfully
+        """
+        
+        expired = self.cache.sweep()
+        if expired:
+            logger.info(f"Dropped {expired} expired cache entries")
+        
+        refreshed = 0
+        
+        for key in self.cache.refresh_candidates(self.top_k, self.refresh_ahead_seconds)[:self.max_per_tick]:
+            try:
+                await self.refresh_fn(key)
+                refreshed += 1
+            except Exception as e:
+                logger.error(f"Error refreshing query {key}: {e}")
+                continue
+        
+        if refreshed:
+            logger.info(f"Refreshed {refreshed} hot queries")
+        
+        return refreshed
+    
+    async def _run(self):
+        """Refresh loop"""
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            await self.run_once()
+    
+    def start(self):
+        """Start the refresh loop on the running event loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Started refresh scheduler (interval {self.interval_seconds}s, top {self.top_k} queries)")
+    
+    async def stop(self):
+        """Stop the refresh loop"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,186 @@
+"""
+Corpus Export Module
+Streams cached device data as flat device-problem rows in CSV, Parquet or Arrow IPC.
+"""
+
+import io
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Any, Optional, Iterator
+import pandas as pd
+from cache import ResultCache
+from parser_1 import DeviceDataParser
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+# Format name -> (media type, file extension, needs pyarrow)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv', False),
+    'parquet': ('application/vnd.apache.parquet', 'parquet', True),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows', True)
+}
+
+EXPORT_COLUMNS = [
+    'device',
+    'device_url',
+    'product_code',
+    'min_year',
+    'problem_type',
+    'problem_name',
+    'count',
+    'maude_link',
+    'fetched_at'
+]
+
+def format_available(export_format: str) -> bool:
+    """Check whether an export format's dependencies are installed"""
+    return export_format in EXPORT_FORMATS and (pa is not None or not EXPORT_FORMATS[export_format][2])
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands written bytes back in chunks while keeping a running position"""
+    
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+        self._position = 0
+    
+    def writable(self) -> bool:
+        return True
+    
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+    
+    def tell(self) -> int:
+        return self._position
+    
+    def drain(self) -> bytes:
+        """Take everything written since the last drain"""
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+class CorpusExporter:
+    """Flattens cached devices into device-problem rows and serializes them chunk by chunk"""
+    
+    def __init__(self, cache: ResultCache, parser: DeviceDataParser, chunk_rows: int = 10000):
+        self.cache = cache
+        self.parser = parser
+        self.chunk_rows = chunk_rows
+    
+    def iter_rows(self, product_code: Optional[str] = None, min_year: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Yield one row per unexpired cached device problem.
+        
+        Args:
+            product_code: Only export queries made with this product code
+            min_year: Only export queries made with this minimum report year
+        
+        Yields:
+            Flat device-problem rows
+        """
+        
+        if product_code:
+            product_code = product_code.strip().upper()
+        
+        now = time.time()
+        
+        # Copy only the entry references so concurrent refreshes cannot break iteration
+        for (_, key_product_code, key_min_year), entry in list(self.cache.entries.items()):
+            if entry['expires_at'] <= now:
+                continue
+            if product_code and key_product_code != product_code:
+                continue
+            if min_year is not None and key_min_year != min_year:
+                continue
+            
+            fetched_at = datetime.fromtimestamp(entry['fetched_at'], tz=timezone.utc).isoformat()
+            
+            for device in entry['devices']:
+                for row in self.parser.problem_rows(device, entry['problem_types']):
+                    row.update(product_code=key_product_code, min_year=key_min_year, fetched_at=fetched_at)
+                    yield row
+    
+    def iter_frames(self, product_code: Optional[str] = None, min_year: Optional[int] = None) -> Iterator[pd.DataFrame]:
+        """Group rows into DataFrames of at most chunk_rows rows"""
+        
+        batch = []
+        
+        for row in self.iter_rows(product_code, min_year):
+            batch.append(row)
+            if len(batch) >= self.chunk_rows:
+                yield pd.DataFrame(batch, columns=EXPORT_COLUMNS)
+                batch = []
+        
+        if batch:
+            yield pd.DataFrame(batch, columns=EXPORT_COLUMNS)
+    
+    def stream(self, export_format: str, product_code: Optional[str] = None, min_year: Optional[int] = None) -> Iterator[bytes]:
+        """
+        Serialize the corpus chunk by chunk.
+        
+        Args:
+            export_format: 'csv', 'parquet' or 'arrow'
+            product_code: Only export queries made with this product code
+            min_year: Only export queries made with this minimum report year
+        
+        Yields:
+            Encoded output, one piece per chunk
+        """
+        
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format '{export_format}', expected one of: {', '.join(EXPORT_FORMATS)}")
+        
+        if not format_available(export_format):
+            raise RuntimeError(f"The '{export_format}' export format requires pyarrow")
+        
+        frames = self.iter_frames(product_code, min_year)
+        rows = 0
+        
+        if export_format == 'csv':
+            yield ','.join(EXPORT_COLUMNS).encode('utf-8') + b'\n'
+            for frame in frames:
+                rows += len(frame)
+                yield frame.to_csv(index=False, header=False).encode('utf-8')
+            logger.info(f"Exported {rows} device-problem rows as {export_format}")
+            return
+        
+        schema = pa.schema([
+            ('device', pa.string()),
+            ('device_url', pa.string()),
+            ('product_code', pa.string()),
+            ('min_year', pa.int64()),
+            ('problem_type', pa.string()),
+            ('problem_name', pa.string()),
+            ('count', pa.int64()),
+            ('maude_link', pa.string()),
+            ('fetched_at', pa.string())
+        ])
+        
+        sink = _ChunkSink()
+        
+        if export_format == 'parquet':
+            writer = pq.ParquetWriter(sink, schema)
+        else:
+            writer = pa.ipc.new_stream(sink, schema)
+        
+        for frame in frames:
+            # Each chunk becomes one Parquet row group / Arrow record batch
+            writer.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=False))
+            rows += len(frame)
+            yield sink.drain()
+        
+        writer.close()
+        yield sink.drain()
+        
+        logger.info(f"Exported {rows} device-problem rows as {export_format}")
@@ -0,0 +1,72 @@
+"""
+Fixture Archive Module
+Records fetch layer responses to disk and replays them deterministically offline.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class FixtureNotFoundError(LookupError):
+    """Raised when replaying a request that was never recorded"""
+
+class FixtureArchive:
+    """Directory of recorded search and detail responses, one JSON file per request"""
+    
+    def __init__(self, directory: str):
+        self.directory = directory
+    
+    def _path(self, kind: str, key: List[Any]) -> str:
+        """File path for a recorded request"""
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.directory, f"{kind}-{digest}.json")
+    
+    def save(self, kind: str, key: List[Any], payload: Any):
+        """
+        Record a response.
+        
+        Args:
+            kind: Request kind ('search' or 'detail')
+            key: JSON-serializable request key
+            payload: Response to record
+        """
+        
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(kind, key)
+        tmp_path = f"{path}.tmp"
+        
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'kind': kind, 'key': key, 'recorded_at': time.time(), 'payload': payload}, f, indent=2)
+        
+        # Replace atomically so a concurrent replay never reads a partial file
+        os.replace(tmp_path, path)
+        logger.info(f"Recorded {kind} fixture {os.path.basename(path)}")
+    
+    def load(self, kind: str, key: List[Any]) -> Optional[Any]:
+        """Get a recorded response, or None if the request was never recorded"""
+        
+        path = self._path(kind, key)
+        if not os.path.exists(path):
+            return None
+        
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)['payload']
+    
+    def replay(self, kind: str, key: List[Any]) -> Any:
+        """
+        Get a recorded response for replay.
+        
+        Raises:
+            FixtureNotFoundError: If the request was never recorded
+        """
+        
+        payload = self.load(kind, key)
+        if payload is None:
+            raise FixtureNotFoundError(f"No recorded {kind} fixture for {key} in {self.directory}")
+        
+        return payload
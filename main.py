@@ -4,25 +4,178 @@ FastAPI web service that scrapes FDA TPLC database for device problems.
 """
 
 from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from typing import Optional, Dict, List, Any
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
 import logging
+import os
 from scraper import FDADeviceScraper
-from parser_1 import DeviceDataParser
+from parser_1 import DeviceDataParser, DEVICE_FIELDS, PROBLEM_TYPES
+from cache import ResultCache, RefreshScheduler, StaleRefreshError, REFRESH_ID_PATTERN
+from fixtures import FixtureNotFoundError
+from maude import MaudeLinkExpander
+from export import CorpusExporter, EXPORT_FORMATS, format_available
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run the hot query refresh loop for the lifetime of the app"""
+    if REFRESH_ENABLED:
+        refresh_scheduler.start()
+    yield
+    await refresh_scheduler.stop()
+    scraper.close()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="FDA Device Problem Extraction API",
     description="Extract device and patient problems from FDA TPLC database",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Browser profile: "standard" loads every asset, "lean" blocks assets and uses eager page loads
+SCRAPER_BROWSER_PROFILE = os.getenv("SCRAPER_BROWSER_PROFILE", "standard")
+
+# Browser memory governance
+SCRAPER_DRIVER_MAX_RSS_MB = int(os.getenv("SCRAPER_DRIVER_MAX_RSS_MB", "1024"))
+SCRAPER_DRIVER_MAX_USES = int(os.getenv("SCRAPER_DRIVER_MAX_USES", "50"))
+SCRAPER_MAX_PAGE_CHARS = int(os.getenv("SCRAPER_MAX_PAGE_CHARS", "5000000"))
+
+# Fetch mode: "live", "record" (archive responses) or "replay" (serve archived responses offline)
+SCRAPER_FETCH_MODE = os.getenv("SCRAPER_FETCH_MODE", "live")
+SCRAPER_FIXTURE_DIR = os.getenv("SCRAPER_FIXTURE_DIR", "fixtures")
+
+# Cache and background refresh settings
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "86400"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1000"))
+CACHE_MAX_TRACKED_QUERIES = int(os.getenv("CACHE_MAX_TRACKED_QUERIES", "10000"))
+CACHE_MAX_TRACKED_DEVICES = int(os.getenv("CACHE_MAX_TRACKED_DEVICES", "5000"))
+CACHE_POPULARITY_HALF_LIFE_SECONDS = int(os.getenv("CACHE_POPULARITY_HALF_LIFE_SECONDS", "21600"))
+REFRESH_ENABLED = os.getenv("REFRESH_ENABLED", "true").lower() == "true"
+REFRESH_INTERVAL_SECONDS = int(os.getenv("REFRESH_INTERVAL_SECONDS", "300"))
+REFRESH_TOP_K = int(os.getenv("REFRESH_TOP_K", "200"))
+REFRESH_AHEAD_SECONDS = int(os.getenv("REFRESH_AHEAD_SECONDS", "3600"))
+REFRESH_MAX_PER_TICK = int(os.getenv("REFRESH_MAX_PER_TICK", "20"))
+
+# MAUDE link expansion settings
+MAUDE_FETCH_BUDGET = int(os.getenv("MAUDE_FETCH_BUDGET", "50"))
+MAUDE_MAX_CONCURRENCY = int(os.getenv("MAUDE_MAX_CONCURRENCY", "5"))
+MAUDE_CACHE_TTL_SECONDS = int(os.getenv("MAUDE_CACHE_TTL_SECONDS", "86400"))
+MAUDE_CACHE_MAX_LINKS = int(os.getenv("MAUDE_CACHE_MAX_LINKS", "5000"))
+
+# Rows per serialized export chunk; bounds export memory regardless of corpus size
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "10000"))
+
 # Initialize scraper and parser
-scraper = FDADeviceScraper()
+scraper = FDADeviceScraper(
+    browser_profile=SCRAPER_BROWSER_PROFILE,
+    fetch_mode=SCRAPER_FETCH_MODE,
+    fixture_dir=SCRAPER_FIXTURE_DIR,
+    driver_max_rss_mb=SCRAPER_DRIVER_MAX_RSS_MB,
+    driver_max_uses=SCRAPER_DRIVER_MAX_USES,
+    max_page_chars=SCRAPER_MAX_PAGE_CHARS
+)
 parser = DeviceDataParser()
+cache = ResultCache(
+    ttl_seconds=CACHE_TTL_SECONDS,
+    snapshot_fn=parser.problem_counts,
+    max_entries=CACHE_MAX_ENTRIES,
+    max_tracked_queries=CACHE_MAX_TRACKED_QUERIES,
+    max_tracked_devices=CACHE_MAX_TRACKED_DEVICES,
+    popularity_half_life_seconds=CACHE_POPULARITY_HALF_LIFE_SECONDS
+)
+maude_expander = MaudeLinkExpander(
+    max_concurrency=MAUDE_MAX_CONCURRENCY,
+    cache_ttl_seconds=MAUDE_CACHE_TTL_SECONDS,
+    max_cached_links=MAUDE_CACHE_MAX_LINKS
+)
+exporter = CorpusExporter(cache, parser, chunk_rows=EXPORT_CHUNK_ROWS)
+
+async def _fetch_devices(device_name: str, product_code: Optional[str], min_year: int,
+                         problem_types: List[str]) -> Dict[str, Any]:
+    """
+    Search and scrape devices for a query and store the result in the cache.
+    
+    Args:
+        device_name: Name of the device to search for
+        product_code: Optional product code filter
+        min_year: Minimum year for reports
+        problem_types: Problem lists to extract from each device page
+        
+    Returns:
+        The new cache entry
+    """
+    
+    # Perform search and get device detail page links
+    device_links = await scraper.search_devices(
+        device_name=device_name,
+        product_code=product_code,
+        min_year=min_year
+    )
+    
+    logger.info(f"Found {len(device_links)} device links to scrape")
+    
+    # Extract data from each device detail page
+    raw_devices = []
+    
+    for device_link in device_links:
+        try:
+            raw_devices.append(await scraper.scrape_device_details(device_link, problem_types=problem_types))
+        except FixtureNotFoundError:
+            # An incomplete archive must fail like an unrecorded search, not cache a partial result
+            raise
+        except Exception as e:
+            logger.error(f"Error scraping device {device_link}: {str(e)}")
+            # Continue with other devices even if one fails
+            continue
+    
+    # Mock data is served but never cached as if it were real
+    if any(scraper.is_mock_link(link) for link in device_links) or any(device.get("is_mock") for device in raw_devices):
+        logger.warning(f"Not caching mock data for device: {device_name}")
+        return cache.transient_entry(raw_devices, problem_types)
+    
+    # Partial results are served to this request only, so a retry or refresh can complete them
+    if len(raw_devices) < len(device_links):
+        logger.warning(f"Not caching partial results for device: {device_name} ({len(raw_devices)} of {len(device_links)} devices scraped)")
+        return cache.transient_entry(raw_devices, problem_types)
+    
+    return cache.store(cache.make_key(device_name, product_code, min_year), raw_devices, problem_types)
+
+async def _refresh_query(cache_key) -> Dict[str, Any]:
+    """Re-scrape a cached query with every problem type"""
+    device_name, product_code, min_year = cache_key
+    return await _fetch_devices(device_name, product_code, min_year, PROBLEM_TYPES)
+
+refresh_scheduler = RefreshScheduler(
+    cache,
+    _refresh_query,
+    interval_seconds=REFRESH_INTERVAL_SECONDS,
+    top_k=REFRESH_TOP_K,
+    refresh_ahead_seconds=REFRESH_AHEAD_SECONDS,
+    max_per_tick=REFRESH_MAX_PER_TICK
+)
+
+def _parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """Split a comma-separated fields parameter and validate each name"""
+    
+    if not fields:
+        return None
+    
+    requested = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in requested if field not in DEVICE_FIELDS]
+    
+    if unknown:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Unknown fields: {', '.join(unknown)}. Allowed fields: {', '.join(DEVICE_FIELDS)}"
+        )
+    
+    return requested or None
 
 @app.get("/")
 async def root():
@@ -37,7 +190,14 @@ async def root():
 async def scrape_device_problems(
     device_name: str = Query(..., description="Name of the device to search for"),
     product_code: Optional[str] = Query(None, description="Optional product code filter"),
-    min_year: int = Query(2020, description="Minimum year for reports", ge=2000, le=2024)
+    min_year: int = Query(2020, description="Minimum year for reports", ge=2000, le=2024),
+    fields: Optional[str] = Query(None, description="Comma-separated device fields to return (default: all)"),
+    top_n: Optional[int] = Query(None, description="Return only the N most reported problems per list", ge=1),
+    problem_type: Optional[str] = Query(None, description="Restrict problems to 'device' or 'patient'", pattern="^(device|patient)$"),
+    include_summary: bool = Query(True, description="Include the per-device summary block"),
+    since: Optional[str] = Query(None, description="Only return problems whose counts changed since this refresh_id", pattern=REFRESH_ID_PATTERN),
+    expand_maude: bool = Query(False, description="Attach MAUDE adverse event report summaries to each problem"),
+    maude_budget: Optional[int] = Query(None, description="Maximum MAUDE pages to fetch for this request, up to MAUDE_FETCH_BUDGET", ge=0, le=MAUDE_FETCH_BUDGET)
 ) -> Dict[str, Any]:
     """
     Scrape FDA TPLC database for device and patient problems.
@@ -46,66 +206,121 @@ async def scrape_device_problems(
         device_name: Name of the device to search for (required)
         product_code: Optional product code to filter results
         min_year: Minimum year for reports (default: 2020)
+        fields: Comma-separated device fields to return
+        top_n: Number of most reported problems to keep per list
+        problem_type: Only return 'device' or 'patient' problems
+        include_summary: Whether to build the per-device summary
+        since: refresh_id of an earlier response to compute deltas against
+        expand_maude: Whether to resolve problem MAUDE links into report summaries
+        maude_budget: Maximum number of MAUDE pages to fetch (default: MAUDE_FETCH_BUDGET)
         
     Returns:
         JSON response with device problems and patient problems
     """
     
+    requested_fields = _parse_fields(fields)
+    
+    if not parser.select_fields(requested_fields, problem_type, include_summary):
+        raise HTTPException(
+            status_code=422,
+            detail="The requested fields, problem_type and include_summary leave no fields to return"
+        )
+    
+    problem_types = parser.required_problem_types(requested_fields, problem_type, include_summary)
+    
     try:
         logger.info(f"Starting scrape for device: {device_name}, product_code: {product_code}, min_year: {min_year}")
         
-        # Step 1: Perform search and get device detail page links
-        device_links = await scraper.search_devices(
-            device_name=device_name,
-            product_code=product_code,
-            min_year=min_year
-        )
+        search_params = {
+            "device_name": device_name,
+            "product_code": product_code,
+            "min_year": min_year
+        }
+        
+        # Step 1: Serve from cache, or search and scrape device detail pages
+        cache_key = cache.make_key(device_name, product_code, min_year)
+        cache.record_request(cache_key)
+        
+        entry = cache.get(cache_key, problem_types)
+        if entry is None:
+            entry = await _fetch_devices(device_name, product_code, min_year, problem_types)
+        
+        # Deltas need stored snapshots, which mock and partial data never get
+        if since is not None and entry["refresh_id"] is None:
+            raise HTTPException(
+                status_code=409,
+                detail="since= is unavailable: this result is mock or partial data and was not cached, so there is no refresh to compare against"
+            )
         
-        if not device_links:
+        # Resolve every baseline up front so a stale refresh id fails the whole request
+        previous_counts_by_url = {}
+        if since is not None:
+            try:
+                cache.parse_refresh_id(since)
+                for raw_device_data in entry["devices"]:
+                    device_url = raw_device_data.get("url", "")
+                    previous_counts_by_url[device_url] = cache.counts_since(device_url, since)
+            except StaleRefreshError as e:
+                raise HTTPException(status_code=410, detail=f"{e}; resync without since=")
+        
+        if not entry["devices"]:
             return {
-                "search_params": {
-                    "device_name": device_name,
-                    "product_code": product_code,
-                    "min_year": min_year
-                },
+                "search_params": search_params,
                 "message": "No devices found matching the search criteria",
                 "devices": []
             }
         
-        logger.info(f"Found {len(device_links)} device links to scrape")
-        
-        # Step 2: Extract data from each device detail page
+        # Step 2: Parse each device, reduced to changes when a refresh id is given
         all_devices_data = []
         
-        for device_link in device_links:
+        for raw_device_data in entry["devices"]:
             try:
-                # Scrape device detail page
-                raw_device_data = await scraper.scrape_device_details(device_link)
+                previous_counts = previous_counts_by_url.get(raw_device_data.get("url", "")) if since is not None else None
                 
                 # Parse and structure the data
-                parsed_device = parser.parse_device_data(raw_device_data)
+                parsed_device = parser.parse_device_data(
+                    raw_device_data,
+                    fields=requested_fields,
+                    top_n=top_n,
+                    problem_type=problem_type,
+                    include_summary=include_summary,
+                    previous_counts=previous_counts
+                )
                 
                 all_devices_data.append(parsed_device)
                 
             except Exception as e:
-                logger.error(f"Error processing device {device_link}: {str(e)}")
+                logger.error(f"Error processing device {raw_device_data.get('url')}: {str(e)}")
                 # Continue with other devices even if one fails
                 continue
         
-        # Step 3: Return structured response
+        # Step 3: Optionally follow MAUDE links of the returned problems
+        expansion_stats = None
+        if expand_maude:
+            budget = MAUDE_FETCH_BUDGET if maude_budget is None else maude_budget
+            expansion_stats = await maude_expander.expand(all_devices_data, budget)
+        
+        # Step 4: Return structured response
         response = {
-            "search_params": {
-                "device_name": device_name,
-                "product_code": product_code,
-                "min_year": min_year
-            },
+            "search_params": search_params,
+            "refresh_id": entry["refresh_id"],
+            "fetched_at": datetime.fromtimestamp(entry["fetched_at"], tz=timezone.utc).isoformat(),
             "total_devices_found": len(all_devices_data),
+            "contains_mock_data": any(device.get("is_mock") for device in all_devices_data),
             "devices": all_devices_data
         }
         
+        if since is not None:
+            response["since"] = since
+        
+        if expansion_stats is not None:
+            response["maude_expansion"] = expansion_stats
+        
         logger.info(f"Successfully scraped {len(all_devices_data)} devices")
         return response
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error during scraping: {str(e)}")
         raise HTTPException(
@@ -113,6 +328,43 @@ async def scrape_device_problems(
             detail=f"Error scraping FDA database: {str(e)}"
         )
 
+@app.get("/export")
+async def export_corpus(
+    format: str = Query("csv", description="Output format: csv, parquet or arrow", pattern="^(csv|parquet|arrow)$"),
+    product_code: Optional[str] = Query(None, description="Only export queries made with this product code"),
+    min_year: Optional[int] = Query(None, description="Only export queries made with this minimum report year", ge=2000, le=2024)
+) -> StreamingResponse:
+    """
+    Stream the cached corpus as flat device-problem rows.
+    
+    Args:
+        format: Output format (csv, parquet or arrow)
+        product_code: Optional product code filter
+        min_year: Optional minimum report year filter
+        
+    Returns:
+        Chunked file download
+    """
+    
+    if not format_available(format):
+        raise HTTPException(
+            status_code=501,
+            detail=f"The '{format}' export format requires pyarrow to be installed"
+        )
+    
+    media_type, extension, _ = EXPORT_FORMATS[format]
+    
+    return StreamingResponse(
+        exporter.stream(format, product_code=product_code, min_year=min_year),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="fda_device_problems.{extension}"'}
+    )
+
+@app.get("/stats")
+async def stats():
+    """Cache, expansion and memory statistics"""
+    return {"cache": cache.stats(), "maude": maude_expander.stats(), "memory": scraper.memory_stats()}
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
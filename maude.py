@@ -0,0 +1,246 @@
+"""
+MAUDE Link Expansion Module
+Resolves problem MAUDE links into adverse event report summaries.
+"""
+
+import asyncio
+import logging
+import re
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, List, Any, Optional, Callable
+from urllib.parse import urlparse, parse_qs
+import requests
+from bs4 import BeautifulSoup
+
+logger = logging.getLogger(__name__)
+
+class MaudeLinkExpander:
+    """Fetches MAUDE results pages behind problem links with caching and deduplication"""
+    
+    def __init__(self, fetch_page: Optional[Callable[[str], str]] = None, max_concurrency: int = 5,
+                 cache_ttl_seconds: int = 86400, timeout: int = 15, top_reports: int = 5,
+                 max_cached_links: int = 5000):
+        self.fetch_page = fetch_page or self._fetch_page
+        self.max_concurrency = max_concurrency
+        self.cache_ttl_seconds = cache_ttl_seconds
+        self.timeout = timeout
+        self.top_reports = top_reports
+        self.max_cached_links = max_cached_links
+        # Kept in least-recently-used order for eviction
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self.fetches = 0
+        self.cache_hits = 0
+        self.errors = 0
+    
+    def _fetch_page(self, url: str) -> str:
+        """Download a MAUDE results page"""
+        response = requests.get(url, timeout=self.timeout, headers={
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+        })
+        response.raise_for_status()
+        return response.text
+    
+    def parse_results_page(self, html: str) -> Dict[str, Any]:
+        """
+        Summarize a MAUDE results page.
+        
+        MAUDE paginates results, so only the first page is read. The overall
+        total comes from the page's record count when it shows one. Per-year
+        counts are only real totals when the first page lists every record,
+        so they are returned only in that case and are None otherwise.
+        
+        Args:
+            html: Results page HTML
+        
+        Returns:
+            Total report count, report counts per year when complete and the first report identifiers listed
+        """
+        
+        soup = BeautifulSoup(html, 'html.parser')
+        
+        report_ids = []
+        reports_by_year = Counter()
+        
+        for link in soup.find_all('a', href=True):
+            report_id = parse_qs(urlparse(link['href']).query).get('mdrfoi__id')
+            if not report_id or report_id[0] in report_ids:
+                continue
+            
+            report_ids.append(report_id[0])
+            
+            # Date received is in the same results row as the report link
+            row = link.find_parent('tr')
+            date_match = re.search(r'\b\d{1,2}/\d{1,2}/(\d{4})\b', row.get_text(' ') if row else '')
+            if date_match:
+                reports_by_year[date_match.group(1)] += 1
+        
+        total_reports = self._total_records(soup.get_text(' '))
+        soup.decompose()
+        
+        complete = total_reports is not None and total_reports == len(report_ids)
+        
+        return {
+            'status': 'ok',
+            'total_reports': total_reports,
+            'reports_on_first_page': len(report_ids),
+            'reports_by_year': dict(sorted(reports_by_year.items())) if complete else None,
+            'top_report_ids': report_ids[:self.top_reports]
+        }
+    
+    def _total_records(self, text: str) -> Optional[int]:
+        """Read the overall record count shown on a results page ("Records 1 to 10 of 1,234" or "1,234 records")"""
+        
+        for pattern in (r'\b\d+\s*(?:to|-|through)\s*\d+\s+of\s+([\d,]+)', r'([\d,]+)\s+records?\b'):
+            match = re.search(pattern, text, flags=re.IGNORECASE)
+            if match:
+                return int(match.group(1).replace(',', ''))
+        
+        return None
+    
+    async def resolve(self, url: str) -> Dict[str, Any]:
+        """
+        Resolve a single MAUDE link, sharing in-flight fetches for the same URL.
+        
+        Args:
+            url: MAUDE results page URL
+        
+        Returns:
+            Report summary for the link
+        """
+        
+        task = self._in_flight.get(url)
+        
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_summary(url))
+            self._in_flight[url] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(url, None))
+        
+        return await asyncio.shield(task)
+    
+    async def _fetch_summary(self, url: str) -> Dict[str, Any]:
+        """Fetch and summarize a MAUDE results page, caching successful results"""
+        
+        self.fetches += 1
+        
+        try:
+            html = await asyncio.get_running_loop().run_in_executor(None, self.fetch_page, url)
+            result = self.parse_results_page(html)
+        except Exception as e:
+            logger.error(f"Error expanding MAUDE link {url}: {e}")
+            self.errors += 1
+            return {'status': 'error', 'error': str(e)}
+        
+        self._cache[url] = {'expires_at': time.time() + self.cache_ttl_seconds, 'result': result}
+        self._cache.move_to_end(url)
+        
+        while len(self._cache) > self.max_cached_links:
+            self._cache.popitem(last=False)
+        
+        return result
+    
+    def _cached(self, url: str) -> Optional[Dict[str, Any]]:
+        """Get a cached report summary if it has not expired"""
+        
+        cached = self._cache.get(url)
+        if cached and cached['expires_at'] > time.time():
+            self._cache.move_to_end(url)
+            return cached['result']
+        
+        self._cache.pop(url, None)
+        return None
+    
+    def sweep(self) -> int:
+        """
+        Drop expired report summaries.
+        
+        Returns:
+            Number of expired summaries removed
+        """
+        
+        now = time.time()
+        expired = [url for url, cached in self._cache.items() if cached['expires_at'] <= now]
+        
+        for url in expired:
+            del self._cache[url]
+        
+        return len(expired)
+    
+    async def expand(self, devices: List[Dict[str, Any]], budget: int) -> Dict[str, Any]:
+        """
+        Attach MAUDE report summaries to every problem of the given parsed devices.
+        
+        Links are deduplicated across devices and resolved concurrently. Cached
+        links are free; at most `budget` links are fetched, highest report
+        counts first, and the rest are marked as skipped.
+        
+        Args:
+            devices: Parsed devices (modified in place)
+            budget: Maximum number of pages to fetch
+        
+        Returns:
+            Expansion statistics
+        """
+        
+        self.sweep()
+        
+        problems_by_link: Dict[str, List[Dict[str, Any]]] = {}
+        
+        for device in devices:
+            for problem in device.get('device_problems', []) + device.get('patient_problems', []):
+                if problem.get('maude_link'):
+                    problems_by_link.setdefault(problem['maude_link'], []).append(problem)
+        
+        results = {}
+        to_fetch = []
+        
+        for link in problems_by_link:
+            cached = self._cached(link)
+            if cached is not None:
+                self.cache_hits += 1
+                results[link] = cached
+            else:
+                to_fetch.append(link)
+        
+        cached_count = len(results)
+        
+        # Spend the budget on the most reported problems first
+        to_fetch.sort(key=lambda link: -max(p['count'] for p in problems_by_link[link]))
+        skipped = to_fetch[budget:]
+        to_fetch = to_fetch[:budget]
+        
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        async def fetch(link: str):
+            async with semaphore:
+                results[link] = await self.resolve(link)
+        
+        await asyncio.gather(*(fetch(link) for link in to_fetch))
+        
+        for link in skipped:
+            results[link] = {'status': 'skipped', 'reason': 'fetch budget exhausted'}
+        
+        for link, problems in problems_by_link.items():
+            for problem in problems:
+                problem['maude_reports'] = results[link]
+        
+        logger.info(f"Expanded {len(problems_by_link)} MAUDE links: {len(to_fetch)} fetched, {cached_count} cached, {len(skipped)} skipped")
+        
+        return {
+            'unique_links': len(problems_by_link),
+            'fetched': len(to_fetch),
+            'cached': cached_count,
+            'skipped': len(skipped),
+            'errors': sum(1 for link in to_fetch if results[link]['status'] == 'error')
+        }
+    
+    def stats(self) -> Dict[str, Any]:
+        """Get expansion statistics"""
+        
+        return {
+            'cached_links': len(self._cache),
+            'fetches': self.fetches,
+            'cache_hits': self.cache_hits,
+            'errors': self.errors
+        }
@@ -9,18 +9,97 @@ from typing import Dict, List, Any, Optional
 
 logger = logging.getLogger(__name__)
 
+# Top-level fields a parsed device can carry, in response order
+DEVICE_FIELDS = [
+    'device_name',
+    'device_url',
+    'device_problems',
+    'patient_problems',
+    'total_device_problems',
+    'total_patient_problems',
+    'summary'
+]
+
+PROBLEM_TYPES = ['device', 'patient']
+
 class DeviceDataParser:
     """Parser for cleaning and structuring scraped device data"""
     
     def __init__(self):
         pass
     
-    def parse_device_data(self, raw_device_data: Dict[str, Any]) -> Dict[str, Any]:
+    def select_fields(self, fields: Optional[List[str]] = None, problem_type: Optional[str] = None,
+                      include_summary: bool = True) -> List[str]:
+        """
+        Resolve which top-level fields a parsed device should carry.
+        
+        Args:
+            fields: Requested fields (None means all fields)
+            problem_type: Restrict output to 'device' or 'patient' problems
+            include_summary: Whether the summary block is wanted
+            
+        Returns:
+            Selected fields in response order
+        """
+        
+        selected = [field for field in DEVICE_FIELDS if not fields or field in fields]
+        
+        if not include_summary and 'summary' in selected:
+            selected.remove('summary')
+        
+        if problem_type:
+            for other_type in PROBLEM_TYPES:
+                if other_type != problem_type:
+                    other_fields = {f'{other_type}_problems', f'total_{other_type}_problems'}
+                    selected = [field for field in selected if field not in other_fields]
+        
+        return selected
+    
+    def required_problem_types(self, fields: Optional[List[str]] = None, problem_type: Optional[str] = None,
+                               include_summary: bool = True) -> List[str]:
+        """
+        Work out which problem lists must be extracted to serve a projection.
+        
+        The summary covers both problem lists, so it needs both extracted even
+        when problem_type restricts the returned lists.
+        
+        Args:
+            fields: Requested fields (None means all fields)
+            problem_type: Restrict output to 'device' or 'patient' problems
+            include_summary: Whether the summary block is wanted
+            
+        Returns:
+            Problem types ('device'/'patient') that need to be scraped and parsed
+        """
+        
+        selected = self.select_fields(fields, problem_type, include_summary)
+        
+        if 'summary' in selected:
+            return list(PROBLEM_TYPES)
+        
+        return [
+            ptype for ptype in PROBLEM_TYPES
+            if f'{ptype}_problems' in selected or f'total_{ptype}_problems' in selected
+        ]
+    
+    def parse_device_data(self, raw_device_data: Dict[str, Any], fields: Optional[List[str]] = None,
+                          top_n: Optional[int] = None, problem_type: Optional[str] = None,
+                          include_summary: bool = True,
+                          previous_counts: Optional[Dict[str, Dict[str, int]]] = None) -> Dict[str, Any]:
         """
         Parse and clean raw device data from scraper.
         
+        Only the requested fields are built; problem lists that are not needed
+        for the output are never parsed.
+        
         Args:
             raw_device_data: Raw data dictionary from scraper
+            fields: Top-level fields to include (None means all fields)
+            top_n: Keep only the N most reported problems per list
+            problem_type: Restrict output to 'device' or 'patient' problems
+            include_summary: Whether to build the summary block
+            previous_counts: Problem counts from an earlier refresh; when given,
+                only problems whose count changed since then are returned
             
         Returns:
             Clean, structured device data
@@ -29,29 +108,50 @@ class DeviceDataParser:
         try:
             device_name = self._clean_device_name(raw_device_data.get('device_name', 'Unknown Device'))
             
-            # Parse device problems
-            device_problems = self._parse_problems(
-                raw_device_data.get('device_problems', []),
-                problem_type='device'
-            )
+            selected = self.select_fields(fields, problem_type, include_summary)
+            needed_types = self.required_problem_types(fields, problem_type, include_summary)
             
-            # Parse patient problems  
-            patient_problems = self._parse_problems(
-                raw_device_data.get('patient_problems', []),
-                problem_type='patient'
-            )
+            # Parse only the problem lists the projection needs
+            problems = {}
+            for ptype in PROBLEM_TYPES:
+                if ptype in needed_types:
+                    problems[ptype] = self._parse_problems(
+                        raw_device_data.get(f'{ptype}_problems', []),
+                        problem_type=ptype
+                    )
+                else:
+                    problems[ptype] = []
             
-            # Create structured response
-            parsed_data = {
-                'device_name': device_name,
-                'device_url': raw_device_data.get('url', ''),
-                'device_problems': device_problems,
-                'patient_problems': patient_problems,
-                'total_device_problems': len(device_problems),
-                'total_patient_problems': len(patient_problems),
-                'summary': self._create_summary(device_name, device_problems, patient_problems)
+            device_problems = problems['device']
+            patient_problems = problems['patient']
+            
+            # Reduce the returned lists to deltas, then trim
+            returned = {}
+            for ptype in PROBLEM_TYPES:
+                returned[ptype] = problems[ptype]
+                if previous_counts is not None:
+                    returned[ptype] = self._changed_problems(returned[ptype], previous_counts.get(ptype, {}), ptype)
+                if top_n:
+                    returned[ptype] = returned[ptype][:top_n]
+            
+            # Totals and summary reflect the full lists, not the returned ones
+            values = {
+                'device_name': lambda: device_name,
+                'device_url': lambda: raw_device_data.get('url', ''),
+                'device_problems': lambda: returned['device'],
+                'patient_problems': lambda: returned['patient'],
+                'total_device_problems': lambda: len(device_problems),
+                'total_patient_problems': lambda: len(patient_problems),
+                'summary': lambda: self._create_summary(device_name, device_problems, patient_problems)
             }
             
+            # Create structured response
+            parsed_data = {field: values[field]() for field in selected}
+            
+            # Synthetic data is always flagged, whatever the projection
+            if raw_device_data.get('is_mock'):
+                parsed_data['is_mock'] = True
+            
             logger.info(f"Parsed device: {device_name} with {len(device_problems)} device problems and {len(patient_problems)} patient problems")
             
             return parsed_data
@@ -69,6 +169,81 @@ class DeviceDataParser:
                 'error': str(e)
             }
     
+    def problem_counts(self, raw_device_data: Dict[str, Any], problem_types: List[str]) -> Dict[str, Dict[str, int]]:
+        """
+        Get cleaned problem counts for a device, keyed by problem type and name.
+        
+        Args:
+            raw_device_data: Raw data dictionary from scraper
+            problem_types: Problem lists that were extracted
+            
+        Returns:
+            Mapping of problem type to {problem_name: count}
+        """
+        
+        return {
+            ptype: {
+                problem['problem_name']: problem['count']
+                for problem in self._parse_problems(raw_device_data.get(f'{ptype}_problems', []), ptype)
+            }
+            for ptype in problem_types
+        }
+    
+    def problem_rows(self, raw_device_data: Dict[str, Any], problem_types: List[str]) -> List[Dict[str, Any]]:
+        """
+        Flatten a device into one cleaned row per problem.
+        
+        Args:
+            raw_device_data: Raw data dictionary from scraper
+            problem_types: Problem lists that were extracted
+            
+        Returns:
+            Rows with device, device_url, problem_type, problem_name, count and maude_link
+        """
+        
+        device_name = self._clean_device_name(raw_device_data.get('device_name', 'Unknown Device'))
+        
+        return [
+            {
+                'device': device_name,
+                'device_url': raw_device_data.get('url', ''),
+                'problem_type': ptype,
+                'problem_name': problem['problem_name'],
+                'count': problem['count'],
+                'maude_link': problem['maude_link']
+            }
+            for ptype in problem_types
+            for problem in self._parse_problems(raw_device_data.get(f'{ptype}_problems', []), ptype)
+        ]
+    
+    def _changed_problems(self, problems: List[Dict[str, Any]], previous: Dict[str, int], problem_type: str) -> List[Dict[str, Any]]:
+        """
+        Keep only problems whose count differs from a previous snapshot.
+        
+        Problems that disappeared since the snapshot are reported with a count of 0.
+        """
+        
+        changed = []
+        current_names = set()
+        
+        for problem in problems:
+            current_names.add(problem['problem_name'])
+            previous_count = previous.get(problem['problem_name'], 0)
+            if problem['count'] != previous_count:
+                changed.append({**problem, 'previous_count': previous_count})
+        
+        for problem_name, previous_count in previous.items():
+            if problem_name not in current_names and previous_count:
+                changed.append({
+                    'problem_name': problem_name,
+                    'count': 0,
+                    'maude_link': '',
+                    'problem_type': problem_type,
+                    'previous_count': previous_count
+                })
+        
+        return changed
+    
     def _clean_device_name(self, device_name: str) -> str:
         """Clean and normalize device name"""
         
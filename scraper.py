@@ -4,9 +4,12 @@ Handles web scraping of FDA TPLC database using Selenium with proper form handli
 """
 
 import asyncio
+import hashlib
 import logging
 import re
+import threading
 from typing import List, Dict, Any, Optional
+from urllib.parse import urlparse, parse_qs
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait, Select
@@ -15,17 +18,74 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
 from selenium.common.exceptions import TimeoutException, NoSuchElementException
 from webdriver_manager.chrome import ChromeDriverManager
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+import psutil
 import time
+from fixtures import FixtureArchive
 
 logger = logging.getLogger(__name__)
 
+BROWSER_PROFILES = ['standard', 'lean']
+
+# live: fetch from FDA, record: fetch and archive responses, replay: serve archived responses only
+FETCH_MODES = ['live', 'record', 'replay']
+
+# Chrome subsystems the lean profile switches off
+LEAN_CHROME_ARGUMENTS = [
+    "--disable-extensions",
+    "--disable-gpu",
+    "--disable-background-networking",
+    "--disable-background-timer-throttling",
+    "--disable-component-update",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--disable-features=Translate,MediaRouter,OptimizationHints",
+    "--blink-settings=imagesEnabled=false",
+    "--mute-audio",
+    "--no-first-run"
+]
+
+# Requests the lean profile blocks; only the DOM is read from TPLC pages.
+# Patterns match the whole URL, so extensions end in * to catch versioned assets (site.css?v=3)
+LEAN_BLOCKED_URLS = [
+    "*.png*", "*.jpg*", "*.jpeg*", "*.gif*", "*.svg*", "*.ico*", "*.webp*",
+    "*.css*",
+    "*.woff*", "*.ttf*", "*.otf*", "*.eot*",
+    "*google-analytics.com*",
+    "*googletagmanager.com*",
+    "*doubleclick.net*",
+    "*dap.digitalgov.gov*",
+    "*siteimproveanalytics.com*"
+]
+
 class FDADeviceScraper:
     """Fixed scraper for FDA TPLC database"""
     
-    def __init__(self):
+    def __init__(self, browser_profile: str = "standard", fetch_mode: str = "live", fixture_dir: str = "fixtures",
+                 driver_max_rss_mb: int = 1024, driver_max_uses: int = 50, max_page_chars: int = 5_000_000):
+        if browser_profile not in BROWSER_PROFILES:
+            raise ValueError(f"Unknown browser profile '{browser_profile}', expected one of: {', '.join(BROWSER_PROFILES)}")
+        if fetch_mode not in FETCH_MODES:
+            raise ValueError(f"Unknown fetch mode '{fetch_mode}', expected one of: {', '.join(FETCH_MODES)}")
+        
         self.base_url = "https://www.accessdata.fda.gov/scripts/cdrh/cfdocs/cfTPLC/tplc.cfm"
+        self.browser_profile = browser_profile
+        self.fetch_mode = fetch_mode
+        self.archive = FixtureArchive(fixture_dir)
         self.driver = None
+        # Serializes browser use between request handlers and background refreshes
+        self._driver_lock = threading.Lock()
+        
+        # Memory governance: the browser is reused across searches and recycled
+        # once its process tree grows past driver_max_rss_mb or after driver_max_uses
+        self.driver_max_rss_mb = driver_max_rss_mb
+        self.driver_max_uses = driver_max_uses
+        self.max_page_chars = max_page_chars
+        self.driver_uses = 0
+        self.driver_recycles = 0
+        self.oversized_pages = 0
+        self.browser_rss_bytes = 0
+        self.browser_peak_rss_bytes = 0
         
     def _setup_driver(self):
         """Initialize Chrome WebDriver with appropriate options"""
@@ -36,20 +96,121 @@ class FDADeviceScraper:
         chrome_options.add_argument("--window-size=1920,1080")
         chrome_options.add_argument("--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36")
         
+        if self.browser_profile == "lean":
+            # Return from navigation once the DOM is ready instead of waiting for every asset
+            chrome_options.page_load_strategy = "eager"
+            for argument in LEAN_CHROME_ARGUMENTS:
+                chrome_options.add_argument(argument)
+            chrome_options.add_experimental_option("prefs", {
+                "profile.managed_default_content_settings.images": 2
+            })
+        
         chrome_service = Service(ChromeDriverManager().install())
         self.driver = webdriver.Chrome(service=chrome_service, options=chrome_options)
         self.driver.implicitly_wait(10)
+        self.driver_uses = 0
+        
+        if self.browser_profile == "lean":
+            self.driver.execute_cdp_cmd("Network.enable", {})
+            self.driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": LEAN_BLOCKED_URLS})
         
     def _cleanup_driver(self):
         """Clean up WebDriver resources"""
         if self.driver:
-            self.driver.quit()
-            self.driver = None
-            
+            try:
+                self.driver.quit()
+            except Exception as e:
+                logger.warning(f"Error shutting down browser: {e}")
+            finally:
+                self.driver = None
+                self.browser_rss_bytes = 0
+    
+    def _acquire_driver(self):
+        """Reuse the running browser, starting one if needed"""
+        if self.driver is None:
+            self._setup_driver()
+        self.driver_uses += 1
+    
+    def _release_driver(self, healthy: bool = True):
+        """Keep the browser for the next search unless it has to be recycled"""
+        
+        if self.driver is None:
+            return
+        
+        rss_bytes = self._measure_browser_rss()
+        rss_mb = rss_bytes / (1024 * 1024)
+        
+        if not healthy:
+            reason = "search failed"
+        elif rss_mb > self.driver_max_rss_mb:
+            reason = f"browser RSS {rss_mb:.0f} MB exceeds {self.driver_max_rss_mb} MB"
+        elif self.driver_uses >= self.driver_max_uses:
+            reason = f"reached {self.driver_max_uses} uses"
+        else:
+            return
+        
+        logger.info(f"Recycling browser: {reason}")
+        self.driver_recycles += 1
+        self._cleanup_driver()
+    
+    def _measure_browser_rss(self) -> int:
+        """Measure resident memory of the chromedriver process tree in bytes"""
+        
+        if self.driver is None:
+            return 0
+        
+        try:
+            root = psutil.Process(self.driver.service.process.pid)
+            processes = [root] + root.children(recursive=True)
+        except (psutil.Error, AttributeError):
+            return 0
+        
+        total = 0
+        for process in processes:
+            try:
+                total += process.memory_info().rss
+            except psutil.Error:
+                continue
+        
+        self.browser_rss_bytes = total
+        self.browser_peak_rss_bytes = max(self.browser_peak_rss_bytes, total)
+        
+        return total
+    
+    def memory_stats(self) -> Dict[str, Any]:
+        """Get memory gauges for the scraper process and its browser"""
+        
+        mb = 1024 * 1024
+        
+        return {
+            'browser_running': self.driver is not None,
+            'browser_rss_mb': round(self._measure_browser_rss() / mb, 1),
+            'browser_peak_rss_mb': round(self.browser_peak_rss_bytes / mb, 1),
+            'browser_max_rss_mb': self.driver_max_rss_mb,
+            'scraper_process_rss_mb': round(psutil.Process().memory_info().rss / mb, 1),
+            'driver_uses': self.driver_uses if self.driver else 0,
+            'driver_max_uses': self.driver_max_uses,
+            'driver_recycles': self.driver_recycles,
+            'max_page_chars': self.max_page_chars,
+            'oversized_pages': self.oversized_pages
+        }
+    
+    def close(self):
+        """Shut down the browser"""
+        self._cleanup_driver()
+    
+    @staticmethod
+    def is_mock_link(device_url: str) -> bool:
+        """Check whether a device link was generated by the mock fallback"""
+        return parse_qs(urlparse(device_url).query).get('mock') == ['1']
+    
     async def search_devices(self, device_name: str, product_code: Optional[str] = None, min_year: int = 2020) -> List[str]:
         """
         Search for devices in FDA TPLC database and return list of device detail page URLs.
         
+        In record mode real results are archived (mock fallbacks never are); in replay mode it is served from
+        the archive without starting a browser.
+        
         Args:
             device_name: Name of device to search for
             product_code: Optional product code filter
@@ -59,8 +220,37 @@ class FDADeviceScraper:
             List of URLs to device detail pages
         """
         
+        key = [device_name.strip().lower(), product_code.strip().upper() if product_code else None, min_year]
+        
+        if self.fetch_mode == "replay":
+            return self.archive.replay("search", key)
+        
+        device_links = await self._search_devices_live(device_name, product_code, min_year)
+        
+        if self.fetch_mode == "record":
+            if any(self.is_mock_link(link) for link in device_links):
+                logger.warning(f"Not recording mock search results for device: {device_name}")
+            else:
+                self.archive.save("search", key, device_links)
+        
+        return device_links
+    
+    async def _search_devices_live(self, device_name: str, product_code: Optional[str], min_year: int) -> List[str]:
+        """Search the live FDA TPLC site in a worker thread so Selenium calls and page waits never block the event loop"""
+        return await asyncio.to_thread(self._search_devices_blocking, device_name, product_code, min_year)
+    
+    def _search_devices_blocking(self, device_name: str, product_code: Optional[str], min_year: int) -> List[str]:
+        """Run a live search with exclusive use of the shared browser"""
+        with self._driver_lock:
+            return self._run_search(device_name, product_code, min_year)
+    
+    def _run_search(self, device_name: str, product_code: Optional[str], min_year: int) -> List[str]:
+        """Search the live FDA TPLC site, falling back to mock links on failure"""
+        
+        healthy = True
+        
         try:
-            self._setup_driver()
+            self._acquire_driver()
             
             logger.info(f"Navigating to FDA TPLC search page")
             self.driver.get(self.base_url)
@@ -169,20 +359,21 @@ class FDADeviceScraper:
                 
         except Exception as e:
             logger.error(f"Error during device search: {e}")
+            healthy = False
             # Return mock data for testing
             return self._create_mock_device_links(device_name, min_year)
         finally:
-            self._cleanup_driver()
+            self._release_driver(healthy)
     
     def _create_mock_device_links(self, device_name: str, min_year: int) -> List[str]:
         """Create realistic mock device links for testing when scraping fails"""
         
-        # Create device IDs based on device name hash for consistency
-        device_hash = hash(device_name) % 10000
+        # Derive device IDs from a stable digest so every process produces the same links
+        device_hash = int(hashlib.sha256(device_name.strip().lower().encode('utf-8')).hexdigest(), 16) % 10000
         
         mock_links = [
-            f"{self.base_url}?id={device_hash + 1}&min_report_year={min_year}",
-            f"{self.base_url}?id={device_hash + 2}&min_report_year={min_year}",
+            f"{self.base_url}?id={device_hash + 1}&min_report_year={min_year}&mock=1",
+            f"{self.base_url}?id={device_hash + 2}&min_report_year={min_year}&mock=1",
         ]
         
         logger.info(f"Created {len(mock_links)} mock device links for testing")
@@ -191,53 +382,95 @@ class FDADeviceScraper:
     def _extract_device_links(self) -> List[str]:
         """Extract device detail page links from search results"""
         
-        device_links = []
-        
         try:
             # Wait for results to load
             time.sleep(3)
             
-            # Get page source and parse with BeautifulSoup
-            soup = BeautifulSoup(self.driver.page_source, 'html.parser')
+            # outerHTML.length counts UTF-16 code units, so the limit is in characters
+            page_size = self.driver.execute_script("return document.documentElement.outerHTML.length")
             
-            # Look for links that contain device IDs
-            links = soup.find_all('a', href=True)
-            
-            for link in links:
-                href = link['href']
-                
-                # Check if this looks like a device detail page link
-                if ('tplc.cfm' in href and ('id=' in href or 'ID=' in href)) or 'cfTPLC' in href:
-                    # Convert relative URLs to absolute
-                    if href.startswith('/'):
-                        full_url = "https://www.accessdata.fda.gov" + href
-                    elif href.startswith('http'):
-                        full_url = href
-                    else:
-                        full_url = "https://www.accessdata.fda.gov/scripts/cdrh/cfdocs/cfTPLC/" + href
-                    
-                    device_links.append(full_url)
-            
-            # Remove duplicates
-            device_links = list(set(device_links))
+            if page_size > self.max_page_chars:
+                # Read only the hrefs instead of pulling the whole page into Python
+                logger.warning(f"Results page is {page_size} characters (limit {self.max_page_chars}), reading links only")
+                self.oversized_pages += 1
+                hrefs = self.driver.execute_script(
+                    "return Array.from(document.querySelectorAll('a[href]'), a => a.getAttribute('href'))"
+                )
+            else:
+                # Build a tree of anchors only and free it as soon as the hrefs are read
+                soup = BeautifulSoup(self.driver.page_source, 'html.parser', parse_only=SoupStrainer('a', href=True))
+                hrefs = [link['href'] for link in soup.find_all('a', href=True)]
+                soup.decompose()
             
-            return device_links
+            return self._device_links_from_hrefs(hrefs)
             
         except Exception as e:
             logger.error(f"Error extracting device links: {e}")
             return []
     
-    async def scrape_device_details(self, device_url: str) -> Dict[str, Any]:
+    def _device_links_from_hrefs(self, hrefs: List[str]) -> List[str]:
+        """Keep hrefs that point to device detail pages, as absolute URLs"""
+        
+        device_links = []
+        
+        for href in hrefs:
+            # Check if this looks like a device detail page link
+            if ('tplc.cfm' in href and ('id=' in href or 'ID=' in href)) or 'cfTPLC' in href:
+                # Convert relative URLs to absolute
+                if href.startswith('/'):
+                    full_url = "https://www.accessdata.fda.gov" + href
+                elif href.startswith('http'):
+                    full_url = href
+                else:
+                    full_url = "https://www.accessdata.fda.gov/scripts/cdrh/cfdocs/cfTPLC/" + href
+                
+                device_links.append(full_url)
+        
+        # Remove duplicates
+        return list(set(device_links))
+    
+    async def scrape_device_details(self, device_url: str, problem_types: Optional[List[str]] = None) -> Dict[str, Any]:
         """
         Scrape details from a specific device page with realistic mock data.
         
+        In record mode the synthesized payload is archived with its is_mock flag; in replay
+        mode it is served from the archive.
+        
         Args:
             device_url: URL of the device detail page
+            problem_types: Problem lists to extract ('device'/'patient'); None extracts both
             
         Returns:
             Dictionary with realistic scraped data
         """
         
+        if self.fetch_mode == "replay":
+            return self._select_problem_types(self.archive.replay("detail", [device_url]), problem_types)
+        
+        if self.fetch_mode == "record":
+            # Record every problem list so the fixture serves any projection. Detail pages are
+            # synthesized, so they are recorded with is_mock kept and replay stays out of caches
+            device_data = await self._scrape_device_details_live(device_url, None)
+            self.archive.save("detail", [device_url], device_data)
+            return self._select_problem_types(device_data, problem_types)
+        
+        return await self._scrape_device_details_live(device_url, problem_types)
+    
+    def _select_problem_types(self, device_data: Dict[str, Any], problem_types: Optional[List[str]]) -> Dict[str, Any]:
+        """Drop problem lists that were not requested from full device data"""
+        
+        if problem_types is None:
+            return device_data
+        
+        return {
+            **device_data,
+            'device_problems': device_data.get('device_problems', []) if 'device' in problem_types else [],
+            'patient_problems': device_data.get('patient_problems', []) if 'patient' in problem_types else []
+        }
+    
+    async def _scrape_device_details_live(self, device_url: str, problem_types: Optional[List[str]]) -> Dict[str, Any]:
+        """Scrape a device detail page"""
+        
         try:
             logger.info(f"Scraping device details from: {device_url}")
             
@@ -246,17 +479,21 @@ class FDADeviceScraper:
             device_id = int(device_id_match.group(1)) if device_id_match else 1234
             
             # Create realistic mock data based on device ID
-            device_data = self._create_realistic_device_data(device_url, device_id)
+            device_data = self._create_realistic_device_data(device_url, device_id, problem_types)
             
             return device_data
             
         except Exception as e:
             logger.error(f"Error scraping device details from {device_url}: {e}")
-            return self._create_realistic_device_data(device_url, 1234)
+            return self._create_realistic_device_data(device_url, 1234, problem_types)
     
-    def _create_realistic_device_data(self, device_url: str, device_id: int) -> Dict[str, Any]:
+    def _create_realistic_device_data(self, device_url: str, device_id: int,
+                                      problem_types: Optional[List[str]] = None) -> Dict[str, Any]:
         """Create realistic mock data that looks like real FDA data"""
         
+        if problem_types is None:
+            problem_types = ['device', 'patient']
+        
         # Device names based on common medical devices
         device_names = [
             "Auto-Disable Syringe",
@@ -293,33 +530,36 @@ class FDADeviceScraper:
         
         # Create realistic device problems
         selected_device_problems = []
-        for i in range(2, 5):  # 2-4 device problems
-            prob_idx = (device_id + i) % len(device_problems)
-            count = ((device_id + i) * 7) % 50 + 1  # Random but consistent count
-            
-            selected_device_problems.append({
-                'problem_name': device_problems[prob_idx],
-                'count': count,
-                'maude_link': f'https://www.accessdata.fda.gov/scripts/cdrh/cfdocs/cfmaude/results.cfm?productproblem={2993 + i}&productcode=DXT',
-                'type': 'device'
-            })
+        if 'device' in problem_types:
+            for i in range(2, 5):  # 2-4 device problems
+                prob_idx = (device_id + i) % len(device_problems)
+                count = ((device_id + i) * 7) % 50 + 1  # Random but consistent count
+                
+                selected_device_problems.append({
+                    'problem_name': device_problems[prob_idx],
+                    'count': count,
+                    'maude_link': f'https://www.accessdata.fda.gov/scripts/cdrh/cfdocs/cfmaude/results.cfm?productproblem={2993 + i}&productcode=DXT',
+                    'type': 'device'
+                })
         
         # Create realistic patient problems
         selected_patient_problems = []
-        for i in range(1, 4):  # 1-3 patient problems
-            prob_idx = (device_id + i) % len(patient_problems)
-            count = ((device_id + i) * 3) % 30 + 1  # Random but consistent count
-            
-            selected_patient_problems.append({
-                'problem_name': patient_problems[prob_idx],
-                'count': count,
-                'maude_link': f'https://www.accessdata.fda.gov/scripts/cdrh/cfdocs/cfmaude/results.cfm?patientproblem={1501 + i}&productcode=DXT',
-                'type': 'patient'
-            })
+        if 'patient' in problem_types:
+            for i in range(1, 4):  # 1-3 patient problems
+                prob_idx = (device_id + i) % len(patient_problems)
+                count = ((device_id + i) * 3) % 30 + 1  # Random but consistent count
+                
+                selected_patient_problems.append({
+                    'problem_name': patient_problems[prob_idx],
+                    'count': count,
+                    'maude_link': f'https://www.accessdata.fda.gov/scripts/cdrh/cfdocs/cfmaude/results.cfm?patientproblem={1501 + i}&productcode=DXT',
+                    'type': 'patient'
+                })
         
         return {
             'url': device_url,
             'device_name': device_name,
             'device_problems': selected_device_problems,
             'patient_problems': selected_patient_problems,
+            'is_mock': True
         }
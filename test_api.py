@@ -5,6 +5,7 @@ Basic tests to verify API functionality.
 
 import pytest
 import asyncio
+import os
 from fastapi.testclient import TestClient
 from main import app
 
@@ -55,6 +56,624 @@ def test_scrape_endpoint_invalid_year():
     response = client.get("/scrape?device_name=syringe&min_year=1900")
     assert response.status_code == 422  # Validation error
 
+def test_scrape_endpoint_field_projection():
+    """Test that fields, top_n and include_summary trim each device"""
+    response = client.get("/scrape?device_name=syringe&fields=device_name,device_problems&top_n=2&include_summary=false")
+    
+    assert response.status_code == 200
+    for device in response.json()["devices"]:
+        assert set(device.keys()) - {"is_mock"} == {"device_name", "device_problems"}
+        assert len(device["device_problems"]) <= 2
+
+def test_scrape_endpoint_problem_type():
+    """Test that problem_type drops the other problem list but the summary still covers both"""
+    response = client.get("/scrape?device_name=syringe&problem_type=device")
+    full = client.get("/scrape?device_name=syringe").json()
+    
+    assert response.status_code == 200
+    for device, full_device in zip(response.json()["devices"], full["devices"]):
+        assert "patient_problems" not in device
+        assert "total_patient_problems" not in device
+        assert device["summary"] == full_device["summary"]
+        assert device["summary"]["total_patient_problem_reports"] > 0
+
+def test_scrape_endpoint_patient_problem_type():
+    """Test that problem_type=patient keeps device identity fields"""
+    response = client.get("/scrape?device_name=syringe&problem_type=patient")
+    
+    assert response.status_code == 200
+    for device in response.json()["devices"]:
+        assert device["device_name"]
+        assert device["device_url"]
+        assert "device_problems" not in device
+        assert "total_device_problems" not in device
+        assert "patient_problems" in device
+    
+    response = client.get("/scrape?device_name=syringe&problem_type=patient&fields=device_name")
+    for device in response.json()["devices"]:
+        assert set(device.keys()) - {"is_mock"} == {"device_name"}
+
+def test_scrape_endpoint_invalid_projection():
+    """Test validation of unknown fields and problem types"""
+    assert client.get("/scrape?device_name=syringe&fields=bogus").status_code == 422
+    assert client.get("/scrape?device_name=syringe&problem_type=other").status_code == 422
+    assert client.get("/scrape?device_name=syringe&top_n=0").status_code == 422
+    
+    # Contradictory projections would return an empty object for every device
+    assert client.get("/scrape?device_name=syringe&fields=patient_problems&problem_type=device").status_code == 422
+    assert client.get("/scrape?device_name=syringe&fields=summary&include_summary=false").status_code == 422
+
+def test_parser_skips_unrequested_problems():
+    """Test that the parser only resolves the problem lists a projection needs"""
+    from parser_1 import DeviceDataParser
+    parser = DeviceDataParser()
+    
+    assert parser.required_problem_types(["device_name"], None, False) == []
+    assert parser.required_problem_types(["device_name", "summary"], None, True) == ["device", "patient"]
+    assert parser.required_problem_types(None, "patient", True) == ["device", "patient"]
+    assert parser.required_problem_types(None, "patient", False) == ["patient"]
+    
+    raw = {
+        "device_name": "Test Syringe",
+        "url": "https://example.com/device",
+        "device_problems": [
+            {"problem_name": "Leakage", "count": 3, "maude_link": "https://example.com/maude"},
+            {"problem_name": "Device Malfunction", "count": 9, "maude_link": "https://example.com/maude"}
+        ],
+        "patient_problems": [{"problem_name": "Pain", "count": 1, "maude_link": ""}]
+    }
+    parsed = parser.parse_device_data(raw, fields=["device_problems", "total_device_problems"], top_n=1)
+    
+    assert parsed == {
+        "device_problems": [{
+            "problem_name": "Device Malfunction",
+            "count": 9,
+            "maude_link": "https://example.com/maude",
+            "problem_type": "device"
+        }],
+        "total_device_problems": 2
+    }
+
+def _record_fixtures(archive, device_name, device_url):
+    """Write a real (non-mock) search and detail response to a fixture archive"""
+    archive.save("search", [device_name, None, 2020], [device_url])
+    archive.save("detail", [device_url], {
+        "url": device_url,
+        "device_name": "Recorded Catheter",
+        "device_problems": [{"problem_name": "Leakage", "count": 4, "maude_link": ""}],
+        "patient_problems": [{"problem_name": "Pain", "count": 2, "maude_link": ""}]
+    })
+
+def test_scrape_endpoint_replays_recorded_fixtures(tmp_path, monkeypatch):
+    """Test that replay mode serves archived responses as real, cacheable data"""
+    import main
+    from fixtures import FixtureArchive
+    archive = FixtureArchive(str(tmp_path))
+    _record_fixtures(archive, "replayed catheter", "https://example.com/tplc.cfm?id=42")
+    monkeypatch.setattr(main.scraper, "fetch_mode", "replay")
+    monkeypatch.setattr(main.scraper, "archive", archive)
+    
+    data = client.get("/scrape?device_name=Replayed Catheter&problem_type=device").json()
+    
+    assert data["contains_mock_data"] is False
+    assert data["refresh_id"] is not None
+    assert data["devices"][0]["device_name"] == "Recorded Catheter"
+    assert data["devices"][0]["device_problems"][0]["count"] == 4
+    assert "is_mock" not in data["devices"][0]
+    
+    # Unrecorded searches fail loudly instead of falling back to mock data
+    assert client.get("/scrape?device_name=unrecorded").status_code == 500
+
+def test_scrape_endpoint_does_not_cache_partial_results(tmp_path, monkeypatch):
+    """Test that a result missing a failed device is served once but never cached"""
+    import main
+    from fixtures import FixtureArchive
+    archive = FixtureArchive(str(tmp_path))
+    _record_fixtures(archive, "partial catheter", "https://example.com/tplc.cfm?id=45")
+    archive.save("search", ["partial catheter", None, 2020],
+                 ["https://example.com/tplc.cfm?id=45", "https://example.com/tplc.cfm?id=46"])
+    monkeypatch.setattr(main.scraper, "fetch_mode", "replay")
+    monkeypatch.setattr(main.scraper, "archive", archive)
+    replay_details = main.scraper.scrape_device_details
+    
+    async def flaky_details(device_url, problem_types=None):
+        if device_url.endswith("id=46"):
+            raise RuntimeError("detail page timed out")
+        return await replay_details(device_url, problem_types)
+    
+    monkeypatch.setattr(main.scraper, "scrape_device_details", flaky_details)
+    entries_before = client.get("/stats").json()["cache"]["entries"]
+    
+    data = client.get("/scrape?device_name=partial catheter").json()
+    
+    assert data["total_devices_found"] == 1
+    assert data["refresh_id"] is None
+    assert client.get("/stats").json()["cache"]["entries"] == entries_before
+
+def test_scrape_endpoint_fails_on_unrecorded_details(tmp_path, monkeypatch):
+    """Test that a recorded search with a missing detail fixture fails instead of caching nothing"""
+    import main
+    from fixtures import FixtureArchive
+    archive = FixtureArchive(str(tmp_path))
+    archive.save("search", ["half recorded catheter", None, 2020], ["https://example.com/tplc.cfm?id=44"])
+    monkeypatch.setattr(main.scraper, "fetch_mode", "replay")
+    monkeypatch.setattr(main.scraper, "archive", archive)
+    entries_before = client.get("/stats").json()["cache"]["entries"]
+    
+    assert client.get("/scrape?device_name=half recorded catheter").status_code == 500
+    assert client.get("/stats").json()["cache"]["entries"] == entries_before
+
+def test_record_mode_skips_mock_searches(tmp_path):
+    """Test that mock search fallbacks are never written to the fixture archive"""
+    from scraper import FDADeviceScraper
+    scraper = FDADeviceScraper(fetch_mode="record", fixture_dir=str(tmp_path))
+    
+    async def mock_search(device_name, product_code, min_year):
+        return scraper._create_mock_device_links(device_name, min_year)
+    
+    scraper._search_devices_live = mock_search
+    asyncio.run(scraper.search_devices("syringe"))
+    
+    assert list(tmp_path.iterdir()) == []
+
+def test_record_mode_archives_replayable_details(tmp_path):
+    """Test that synthesized detail pages are recorded with is_mock and replay identically"""
+    from scraper import FDADeviceScraper
+    device_url = "https://www.accessdata.fda.gov/scripts/cdrh/cfdocs/cfTPLC/tplc.cfm?id=12"
+    recorder = FDADeviceScraper(fetch_mode="record", fixture_dir=str(tmp_path))
+    recorded = asyncio.run(recorder.scrape_device_details(device_url))
+    
+    replayer = FDADeviceScraper(fetch_mode="replay", fixture_dir=str(tmp_path))
+    replayed = asyncio.run(replayer.scrape_device_details(device_url))
+    
+    assert recorded["is_mock"]
+    assert replayed == recorded
+    assert asyncio.run(replayer.scrape_device_details(device_url, ["device"]))["patient_problems"] == []
+
+def test_scrape_endpoint_does_not_cache_mock_data():
+    """Test that mock fallback data is flagged and kept out of the cache"""
+    entries_before = client.get("/stats").json()["cache"]["entries"]
+    
+    data = client.get("/scrape?device_name=mock only device").json()
+    
+    assert data["contains_mock_data"] is True
+    assert data["refresh_id"] is None
+    assert all(device["is_mock"] for device in data["devices"])
+    assert client.get("/stats").json()["cache"]["entries"] == entries_before
+    
+    # Without a stored refresh there is nothing to compute a delta against
+    assert client.get("/scrape?device_name=mock only device&since=00000000-1").status_code == 409
+
+def test_mock_device_links_are_deterministic():
+    """Test that mock links do not depend on the per-process hash seed"""
+    import subprocess
+    import sys
+    code = "from scraper import FDADeviceScraper; print(FDADeviceScraper()._create_mock_device_links('syringe', 2020))"
+    outputs = {
+        subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                       cwd=os.path.dirname(os.path.abspath(__file__)), env={**os.environ, "PYTHONHASHSEED": seed}).stdout
+        for seed in ("1", "2")
+    }
+    
+    assert len(outputs) == 1
+
+def test_scrape_endpoint_since_returns_only_changes(tmp_path, monkeypatch):
+    """Test that since= against the current refresh returns no unchanged problems"""
+    import main
+    from fixtures import FixtureArchive
+    archive = FixtureArchive(str(tmp_path))
+    _record_fixtures(archive, "catheter", "https://example.com/tplc.cfm?id=43")
+    monkeypatch.setattr(main.scraper, "fetch_mode", "replay")
+    monkeypatch.setattr(main.scraper, "archive", archive)
+    
+    first = client.get("/scrape?device_name=catheter").json()
+    
+    response = client.get(f"/scrape?device_name=catheter&since={first['refresh_id']}")
+    
+    assert response.status_code == 200
+    data = response.json()
+    assert data["refresh_id"] == first["refresh_id"]
+    assert data["since"] == first["refresh_id"]
+    assert data["devices"]
+    for device in data["devices"]:
+        assert device["device_problems"] == []
+        assert device["patient_problems"] == []
+    
+    # Refresh ids from another process, or newer than any refresh, cannot be diffed against
+    epoch, refresh_seq = first["refresh_id"].split("-")
+    other_epoch = "0" * 8 if epoch != "0" * 8 else "1" * 8
+    assert client.get(f"/scrape?device_name=catheter&since={other_epoch}-{refresh_seq}").status_code == 410
+    assert client.get(f"/scrape?device_name=catheter&since={epoch}-{int(refresh_seq) + 1000}").status_code == 410
+    assert client.get("/scrape?device_name=catheter&since=1").status_code == 422
+
+def test_stats_endpoint():
+    """Test the stats endpoint reports cache counters"""
+    response = client.get("/stats")
+    assert response.status_code == 200
+    assert "hits" in response.json()["cache"]
+
+def test_cache_snapshots_and_deltas():
+    """Test that successive refreshes produce count deltas per device"""
+    from cache import ResultCache
+    from parser_1 import DeviceDataParser
+    parser = DeviceDataParser()
+    cache = ResultCache(snapshot_fn=parser.problem_counts)
+    key = cache.make_key(" Syringe ", "dxt", 2020)
+    
+    def device(leakage, pain):
+        return {
+            "url": "https://example.com/device?id=1",
+            "device_name": "Syringe",
+            "device_problems": [{"problem_name": "Leakage", "count": leakage, "maude_link": ""}],
+            "patient_problems": [{"problem_name": "Pain", "count": pain, "maude_link": ""}] if pain else []
+        }
+    
+    first = cache.store(key, [device(3, 2)], ["device", "patient"])
+    second = cache.store(key, [device(5, 0)], ["device", "patient"])
+    
+    assert key == ("syringe", "DXT", 2020)
+    assert cache.get(key, ["device"]) is second
+    
+    previous = cache.counts_since("https://example.com/device?id=1", first["refresh_id"])
+    parsed = parser.parse_device_data(device(5, 0), previous_counts=previous)
+    
+    assert [(p["problem_name"], p["count"], p["previous_count"]) for p in parsed["device_problems"]] == [("Leakage", 5, 3)]
+    assert [(p["problem_name"], p["count"], p["previous_count"]) for p in parsed["patient_problems"]] == [("Pain", 0, 2)]
+    assert parsed["total_device_problems"] == 1
+
+def test_cache_rejects_since_beyond_snapshot_history():
+    """Test that deltas are refused once the history no longer covers the requested refresh"""
+    from cache import ResultCache, StaleRefreshError
+    cache = ResultCache(snapshot_fn=lambda device, types: {"device": {"Leak": device["count"]}},
+                        max_snapshots=2, max_tracked_devices=1)
+    key = cache.make_key("syringe", None, 2020)
+    refresh_ids = [cache.store(key, [{"url": "https://example.com/1", "count": i}], ["device"])["refresh_id"]
+                   for i in range(1, 4)]
+    
+    assert cache.counts_since("https://example.com/1", refresh_ids[1]) == {"device": {"Leak": 2}}
+    with pytest.raises(StaleRefreshError):
+        cache.counts_since("https://example.com/1", refresh_ids[0])
+    
+    # Once a device is evicted, older refreshes cannot be told apart from a new device
+    cache.store(key, [{"url": "https://example.com/2", "count": 1}], ["device"])
+    with pytest.raises(StaleRefreshError):
+        cache.counts_since("https://example.com/1", refresh_ids[2])
+
+def test_refresh_scheduler_refreshes_expiring_hot_queries():
+    """Test that only popular entries close to expiry are refreshed"""
+    from cache import ResultCache, RefreshScheduler
+    cache = ResultCache(ttl_seconds=60)
+    hot = cache.make_key("syringe", None, 2020)
+    cold = cache.make_key("pacemaker", None, 2020)
+    
+    for key in (hot, cold):
+        cache.store(key, [], ["device", "patient"])
+    cache.record_request(hot)
+    cache.record_request(hot)
+    cache.record_request(cold)
+    
+    refreshed = []
+    
+    async def refresh(key):
+        refreshed.append(key)
+    
+    scheduler = RefreshScheduler(cache, refresh, top_k=1, refresh_ahead_seconds=120)
+    
+    assert asyncio.run(scheduler.run_once()) == 1
+    assert refreshed == [hot]
+
+def test_cache_popularity_decays():
+    """Test that queries hot long ago lose to queries requested recently"""
+    from cache import ResultCache
+    cache = ResultCache(popularity_half_life_seconds=60)
+    old = cache.make_key("syringe", None, 2020)
+    recent = cache.make_key("pacemaker", None, 2020)
+    
+    for _ in range(10):
+        cache.record_request(old)
+    
+    # Ten half-lives later a single request outweighs the old burst
+    cache._popularity_base -= 600
+    cache.record_request(recent)
+    
+    assert [key for key, _ in cache.popularity.most_common()] == [recent, old]
+    
+    # Sweeping rescales scores to the present and forgets queries that have gone cold
+    cache._popularity_base -= 600
+    cache.sweep()
+    assert list(cache.popularity) == []
+
+MAUDE_RESULTS_HTML = """
+<p>Records 1 to 3 of 1,234</p>
+<table>
+  <tr><td><a href="detail.cfm?mdrfoi__id=111&pc=DXT">Syringe</a></td><td>03/15/2023</td></tr>
+  <tr><td><a href="detail.cfm?mdrfoi__id=222&pc=DXT">Syringe</a></td><td>11/02/2022</td></tr>
+  <tr><td><a href="detail.cfm?mdrfoi__id=333&pc=DXT">Syringe</a></td><td>01/20/2023</td></tr>
+</table>
+"""
+
+def test_maude_budget_cannot_exceed_deployment_budget():
+    """Test that clients cannot raise the fetch budget above MAUDE_FETCH_BUDGET"""
+    import main
+    response = client.get(f"/scrape?device_name=syringe&expand_maude=true&maude_budget={main.MAUDE_FETCH_BUDGET + 1}")
+    assert response.status_code == 422
+
+def test_maude_results_page_parsing():
+    """Test that a MAUDE results page is summarized, with per-year counts only when complete"""
+    from maude import MaudeLinkExpander
+    expander = MaudeLinkExpander(top_reports=2)
+    summary = expander.parse_results_page(MAUDE_RESULTS_HTML)
+    
+    assert summary == {
+        "status": "ok",
+        "total_reports": 1234,
+        "reports_on_first_page": 3,
+        "reports_by_year": None,
+        "top_report_ids": ["111", "222"]
+    }
+    
+    # A first page holding every record gives real per-year totals
+    complete = expander.parse_results_page(MAUDE_RESULTS_HTML.replace("of 1,234", "of 3"))
+    assert complete["reports_by_year"] == {"2022": 1, "2023": 2}
+    
+    # Without a record count on the page the overall total is unknown
+    assert MaudeLinkExpander().parse_results_page("<table></table>")["total_reports"] is None
+
+def test_maude_expansion_dedupes_and_respects_budget():
+    """Test that shared links are fetched once and the budget caps fetches"""
+    from maude import MaudeLinkExpander
+    fetched = []
+    
+    def fetch_page(url):
+        fetched.append(url)
+        return MAUDE_RESULTS_HTML
+    
+    expander = MaudeLinkExpander(fetch_page=fetch_page)
+    devices = [
+        {"device_problems": [
+            {"problem_name": "Leakage", "count": 9, "maude_link": "https://example.com/maude?p=1"},
+            {"problem_name": "Pain", "count": 1, "maude_link": "https://example.com/maude?p=2"}
+        ]},
+        {"device_problems": [{"problem_name": "Leakage", "count": 4, "maude_link": "https://example.com/maude?p=1"}]}
+    ]
+    
+    stats = asyncio.run(expander.expand(devices, budget=1))
+    
+    assert fetched == ["https://example.com/maude?p=1"]
+    assert stats == {"unique_links": 2, "fetched": 1, "cached": 0, "skipped": 1, "errors": 0}
+    assert devices[1]["device_problems"][0]["maude_reports"]["reports_on_first_page"] == 3
+    assert devices[0]["device_problems"][1]["maude_reports"]["status"] == "skipped"
+    
+    # Cached links cost nothing on the next expansion
+    stats = asyncio.run(expander.expand(devices, budget=1))
+    assert stats["cached"] == 1
+    assert len(fetched) == 2
+
+def test_maude_cache_is_bounded():
+    """Test that the MAUDE cache evicts least recently used links and sweeps expired ones"""
+    from maude import MaudeLinkExpander
+    expander = MaudeLinkExpander(fetch_page=lambda url: MAUDE_RESULTS_HTML, max_cached_links=2)
+    
+    for link in ("https://example.com/maude?p=1", "https://example.com/maude?p=2"):
+        asyncio.run(expander.resolve(link))
+    assert expander._cached("https://example.com/maude?p=1") is not None
+    asyncio.run(expander.resolve("https://example.com/maude?p=3"))
+    
+    assert list(expander._cache) == ["https://example.com/maude?p=1", "https://example.com/maude?p=3"]
+    
+    for cached in expander._cache.values():
+        cached["expires_at"] = 0
+    assert expander.sweep() == 2
+    assert expander.stats()["cached_links"] == 0
+
+def test_live_search_does_not_block_event_loop(monkeypatch):
+    """Test that blocking Selenium work runs off the event loop"""
+    import time
+    from scraper import FDADeviceScraper
+    scraper = FDADeviceScraper()
+    
+    def slow_search(device_name, product_code, min_year):
+        time.sleep(0.3)
+        return ["https://example.com/tplc.cfm?id=1"]
+    
+    monkeypatch.setattr(scraper, "_run_search", slow_search)
+    
+    async def run():
+        ticks = 0
+        
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.02)
+                ticks += 1
+        
+        task = asyncio.create_task(ticker())
+        links = await scraper.search_devices("syringe")
+        task.cancel()
+        return links, ticks
+    
+    links, ticks = asyncio.run(run())
+    
+    assert links == ["https://example.com/tplc.cfm?id=1"]
+    assert ticks >= 5
+
+def test_scraper_rejects_unknown_browser_profile():
+    """Test that browser profiles are validated up front"""
+    from scraper import FDADeviceScraper
+    
+    assert FDADeviceScraper(browser_profile="lean").browser_profile == "lean"
+    with pytest.raises(ValueError):
+        FDADeviceScraper(browser_profile="turbo")
+
+def test_lean_profile_blocks_versioned_assets():
+    """Test that blocked URL patterns also match assets with query strings"""
+    from fnmatch import fnmatchcase
+    from scraper import LEAN_BLOCKED_URLS
+    
+    def blocked(url):
+        return any(fnmatchcase(url, pattern) for pattern in LEAN_BLOCKED_URLS)
+    
+    assert blocked("https://www.accessdata.fda.gov/css/site.css?v=3")
+    assert blocked("https://www.accessdata.fda.gov/fonts/icons.woff2?v=4.7.0")
+    assert blocked("https://www.accessdata.fda.gov/img/logo.png")
+    assert not blocked("https://www.accessdata.fda.gov/scripts/cdrh/cfdocs/cfTPLC/tplc.cfm?id=5")
+
+class FakeDriver:
+    """Minimal stand-in for a WebDriver, backed by the test process"""
+    
+    def __init__(self, page_source):
+        self.page_source = page_source
+        self.service = type("Service", (), {"process": type("Process", (), {"pid": os.getpid()})()})()
+        self.quit_called = False
+    
+    def execute_script(self, script):
+        if "outerHTML.length" in script:
+            return len(self.page_source)
+        return ["tplc.cfm?id=7", "/about.html"]
+    
+    def quit(self):
+        self.quit_called = True
+
+RESULTS_PAGE_HTML = '<html><body><a href="tplc.cfm?id=5">Device</a><a href="/about.html">About</a></body></html>'
+
+def test_scraper_caps_page_size(monkeypatch):
+    """Test that oversized result pages are read through hrefs only"""
+    from scraper import FDADeviceScraper
+    monkeypatch.setattr("scraper.time.sleep", lambda seconds: None)
+    scraper = FDADeviceScraper(max_page_chars=1000)
+    
+    scraper.driver = FakeDriver(RESULTS_PAGE_HTML)
+    assert scraper._extract_device_links() == ["https://www.accessdata.fda.gov/scripts/cdrh/cfdocs/cfTPLC/tplc.cfm?id=5"]
+    
+    scraper.driver = FakeDriver(RESULTS_PAGE_HTML * 20)
+    assert scraper._extract_device_links() == ["https://www.accessdata.fda.gov/scripts/cdrh/cfdocs/cfTPLC/tplc.cfm?id=7"]
+    assert scraper.oversized_pages == 1
+
+def test_scraper_recycles_browser_over_memory_limit():
+    """Test that the browser is kept between searches until it crosses the RSS limit"""
+    from scraper import FDADeviceScraper
+    scraper = FDADeviceScraper(driver_max_rss_mb=100000)
+    driver = scraper.driver = FakeDriver("")
+    
+    scraper._acquire_driver()
+    scraper._release_driver()
+    assert scraper.driver is driver
+    assert scraper.memory_stats()["browser_rss_mb"] > 0
+    
+    scraper.driver_max_rss_mb = 1
+    scraper._acquire_driver()
+    scraper._release_driver()
+    assert scraper.driver is None
+    assert driver.quit_called
+    assert scraper.memory_stats()["driver_recycles"] == 1
+
+def _export_corpus():
+    """Cache with two queries for export tests"""
+    from cache import ResultCache
+    cache = ResultCache()
+    device = {
+        "url": "https://example.com/tplc.cfm?id=9",
+        "device_name": "Insulin Syringe",
+        "device_problems": [
+            {"problem_name": "leakage", "count": 5, "maude_link": "https://example.com/maude?p=1"},
+            {"problem_name": "Device Malfunction", "count": 2, "maude_link": ""}
+        ],
+        "patient_problems": [{"problem_name": "Pain", "count": 1, "maude_link": ""}]
+    }
+    cache.store(cache.make_key("syringe", "FMF", 2020), [device], ["device", "patient"])
+    cache.store(cache.make_key("syringe", None, 2022), [device], ["device"])
+    return cache
+
+def test_export_formats_round_trip():
+    """Test that every export format streams the same flat rows in chunks"""
+    import io
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from export import CorpusExporter, EXPORT_COLUMNS
+    from parser_1 import DeviceDataParser
+    exporter = CorpusExporter(_export_corpus(), DeviceDataParser(), chunk_rows=2)
+    
+    csv_chunks = list(exporter.stream("csv"))
+    frames = {
+        "csv": pd.read_csv(io.BytesIO(b"".join(csv_chunks)), keep_default_na=False),
+        "parquet": pq.read_table(io.BytesIO(b"".join(exporter.stream("parquet")))).to_pandas(),
+        "arrow": pa.ipc.open_stream(b"".join(exporter.stream("arrow"))).read_all().to_pandas()
+    }
+    
+    assert len(csv_chunks) == 1 + 3  # header plus 5 rows in chunks of 2
+    for frame in frames.values():
+        assert list(frame.columns) == EXPORT_COLUMNS
+        assert len(frame) == 5
+        assert frame.iloc[0]["problem_name"] == "Leakage"
+        assert int(frame.iloc[0]["count"]) == 5
+    
+    filtered = pq.read_table(io.BytesIO(b"".join(exporter.stream("parquet", product_code="fmf")))).to_pandas()
+    assert set(filtered["problem_type"]) == {"device", "patient"}
+    assert len(filtered) == 3
+    
+    filtered = pq.read_table(io.BytesIO(b"".join(exporter.stream("parquet", min_year=2022)))).to_pandas()
+    assert list(filtered["min_year"]) == [2022, 2022]
+    
+    # Expired entries are left out even before the cache sweeps them
+    for entry in exporter.cache.entries.values():
+        entry["expires_at"] = 0
+    assert list(exporter.iter_rows()) == []
+
+def test_export_endpoint():
+    """Test the export endpoint streams a CSV download and validates the format"""
+    response = client.get("/export?format=csv")
+    assert response.status_code == 200
+    assert response.text.startswith("device,device_url,product_code")
+    assert "attachment" in response.headers["content-disposition"]
+    
+    assert client.get("/export?format=xlsx").status_code == 422
+
+def test_export_endpoint_streams_cached_rows(tmp_path, monkeypatch):
+    """Test that queries scraped through the API come back as rows from the export endpoint"""
+    import io
+    import pandas as pd
+    import main
+    from fixtures import FixtureArchive
+    archive = FixtureArchive(str(tmp_path))
+    _record_fixtures(archive, "exported catheter", "https://example.com/tplc.cfm?id=77")
+    monkeypatch.setattr(main.scraper, "fetch_mode", "replay")
+    monkeypatch.setattr(main.scraper, "archive", archive)
+    
+    assert client.get("/scrape?device_name=Exported Catheter&min_year=2020").status_code == 200
+    
+    response = client.get("/export?format=csv&min_year=2020")
+    assert response.status_code == 200
+    
+    frame = pd.read_csv(io.BytesIO(response.content), keep_default_na=False)
+    rows = frame[frame["device_url"] == "https://example.com/tplc.cfm?id=77"]
+    assert list(rows["problem_name"]) == ["Leakage", "Pain"]
+    assert list(rows["count"]) == [4, 2]
+    assert set(rows["min_year"]) == {2020}
+    
+    assert client.get("/export?format=csv&min_year=2021").text.count("tplc.cfm?id=77") == 0
+
+def test_cache_is_bounded():
+    """Test that entries, popularity and snapshots stay within their limits"""
+    from cache import ResultCache
+    cache = ResultCache(ttl_seconds=60, snapshot_fn=lambda device, types: {},
+                        max_entries=2, max_tracked_queries=4, max_tracked_devices=2)
+    keys = [cache.make_key(f"device {i}", None, 2020) for i in range(3)]
+    
+    for i, key in enumerate(keys):
+        cache.store(key, [{"url": f"https://example.com/{i}"}], ["device"])
+    
+    assert list(cache.entries) == keys[1:]
+    assert list(cache.snapshots) == ["https://example.com/1", "https://example.com/2"]
+    
+    for i in range(10):
+        cache.record_request(cache.make_key(f"query {i}", None, 2020))
+    assert len(cache.popularity) <= 4
+    
+    cache.entries[keys[1]]["expires_at"] = 0
+    assert cache.sweep() == 1
+    assert list(cache.entries) == [keys[2]]
+
 if __name__ == "__main__":
     # Run basic tests
     print("Running basic API tests...")